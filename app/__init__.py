@@ -2,21 +2,38 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
 from flask_cors import CORS
-from flask_session import Session
 
 db = SQLAlchemy()
 
 def create_app():
     app = Flask(__name__)
-    CORS(app) # Allow all origins for simplicity, adjust as necessary for production
+    CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'Idempotent-Replayed', 'X-DB-Commits', 'X-DB-Flushes']) # Allow all origins for simplicity, adjust as necessary for production
     app.config.from_object(Config)
-    # Initialize SQLAlchemy before Flask-Session
+    # Initialize SQLAlchemy before the session backend, which may store sessions in it
     db.init_app(app)
-    # Now set up Flask-Session with SQLAlchemy as the session interface
-    app.config['SESSION_TYPE'] = 'sqlalchemy'
-    app.config['SESSION_SQLALCHEMY'] = db  # Provide the existing db instance to Flask-Session 
-    # Initialize Flask-Session
-    Session(app)
+    # Count queries per request so views can declare a query budget
+    from app.utils import register_query_counter
+    register_query_counter()
+    # One transaction per request, committed after the view returns
+    from app import unit_of_work
+    unit_of_work.init_app(app)
+    # Listing caches, invalidated across workers through Postgres LISTEN/NOTIFY
+    from app import cache, pubsub, events
+    cache.init_app(app)
+    events.init_app(app)
+    pubsub.init_app(app)
+    # Document bytes live in a content-addressed blob store
+    from app import storage, images, uploads, idempotency
+    storage.init_app(app)
+    images.init_app(app)
+    uploads.init_app(app)
+    idempotency.init_app(app)
+    # bcrypt runs on a bounded process pool instead of the request worker
+    from app import passwords
+    passwords.init_app(app)
+    # Session storage (signed cookie, Redis, or the old Flask-Session table), per SESSION_BACKEND
+    from app import sessions
+    sessions.init_app(app)
     from app.route import main_bp
     app.register_blueprint(main_bp)
     from app.routes.auth import auth_bp
@@ -31,6 +48,8 @@ def create_app():
     app.register_blueprint(offers_bp, url_prefix='/offers')
     from app.routes.task_progress import task_progress_bp
     app.register_blueprint(task_progress_bp, url_prefix='/task_progress')
+    from app.routes.events import events_bp
+    app.register_blueprint(events_bp, url_prefix='/events')
     
     # Import models to ensure they are registered with SQLAlchemy
     from app import models
@@ -0,0 +1,202 @@
+import codecs
+import csv
+import json
+import tempfile
+from decimal import Decimal, InvalidOperation
+from flask import current_app
+from sqlalchemy import text
+from app import db
+from app.models import User, Role
+
+'''
+Bulk listing import for onboarding brokerages.
+Rows are validated in one streaming pass, written to a spooled CSV, loaded with COPY into a temporary
+staging table and merged into Listings with a single INSERT ... SELECT. The per-listing gates of the
+seller workflow (notify FSH, photos) do not apply: these listings come from an existing brokerage.
+'''
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+IMPORT_STATUSES = ('Pending Approval', 'Approved')
+STAGING_COLUMNS = ('line_no', 'seller_id', 'title', 'price', 'description', 'address', 'status',
+                   'bedrooms', 'bathrooms', 'squarefootage')
+MAX_PRICE = Decimal('99999999.99')  # Listings.price is NUMERIC(10, 2)
+
+def detect_format(file_name, declared=None):
+    """Pick the import format from an explicit value or the file extension."""
+    if declared:
+        return declared.lower()
+    if file_name and file_name.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+def iter_records(stream, file_format):
+    """Yield (line_no, record dict) from a binary CSV or NDJSON stream without reading it all into memory."""
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_no, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_no, record if isinstance(record, dict) else None
+
+def _whole_number(value):
+    """int() that refuses to truncate: 2, 2.0 and '2' are fine, 2.7, '2.7' and True are not."""
+    if isinstance(value, bool):
+        raise ValueError(f'{value!r} is not a whole number')
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f'{value!r} is not a whole number')
+        return int(value)
+    if isinstance(value, str):
+        return int(value.strip())  # Raises for '2.7'
+    if isinstance(value, int):
+        return value
+    raise TypeError(f'{value!r} is not a whole number')
+
+def _optional_count(record, field):
+    value = record.get(field)
+    if value in (None, ''):
+        return None
+    count = _whole_number(value)
+    if count < 0:
+        raise ValueError(f'{field} cannot be negative')
+    return count
+
+def validate_record(record, seller_ids, default_seller_id=None):
+    """Return (staging row values, None) for a valid record, or (None, error message)."""
+    if record is None:
+        return None, 'Row is not a JSON object'
+    try:
+        seller_id = record.get('seller_id') or default_seller_id
+        seller_id = _whole_number(seller_id) if seller_id not in (None, '') else None
+    except (TypeError, ValueError):
+        return None, 'seller_id must be an integer'
+    if seller_id not in seller_ids:
+        return None, 'seller_id is missing or is not a Seller'
+
+    text_fields = [record.get(field) or '' for field in ('title', 'description', 'address')]
+    if not all(isinstance(value, str) for value in text_fields):
+        return None, 'title, description and address must be strings'
+    title, description, address = (value.strip() for value in text_fields)
+    if not (title and description and address):
+        return None, 'title, description and address are required'
+    if len(title) > 255:
+        return None, 'title is longer than 255 characters'
+
+    try:
+        price = Decimal(str(record.get('price'))).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None, 'price must be a number'
+    if not price.is_finite() or not Decimal('0') < price <= MAX_PRICE:
+        return None, 'price must be greater than 0 and at most 99999999.99'
+
+    status = record.get('status') or 'Pending Approval'
+    if status not in IMPORT_STATUSES:
+        return None, f"status must be one of: {', '.join(IMPORT_STATUSES)}"
+
+    try:
+        bedrooms = _optional_count(record, 'bedrooms')
+        bathrooms = _optional_count(record, 'bathrooms')
+        squarefootage = _optional_count(record, 'squarefootage')
+    except (TypeError, ValueError) as e:
+        return None, f'bedrooms, bathrooms and squarefootage must be whole numbers ({e})'
+
+    return (seller_id, title, price, description, address, status, bedrooms, bathrooms, squarefootage), None
+
+def import_listings(stream, file_format, default_seller_id=None):
+    """
+    Validate and load listings from `stream` in the current transaction; the caller commits.
+    Returns a report with the number of rows read and imported, and the errors per line.
+    Rows duplicating an existing listing (same seller and address), or an earlier row of the file, are skipped.
+    """
+    max_errors = current_app.config['BULK_IMPORT_MAX_REPORTED_ERRORS']
+    seller_ids = set(db.session.scalars(
+        db.select(User.id).join(User.role).where(Role.role_name == 'Seller')
+    ))
+
+    errors = []
+    error_count = 0
+    total = 0
+    staged = 0
+
+    def report(line_no, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < max_errors:
+            errors.append({'line': line_no, 'error': message})
+
+    # Stream valid rows into a spooled CSV that is handed to COPY; it spills to disk for big files
+    with tempfile.SpooledTemporaryFile(max_size=current_app.config['BULK_IMPORT_SPOOL_SIZE'], mode='w+', newline='') as buffer:
+        writer = csv.writer(buffer)
+        for line_no, record in iter_records(stream, file_format):
+            total += 1
+            values, error = validate_record(record, seller_ids, default_seller_id)
+            if error:
+                report(line_no, error)
+                continue
+            writer.writerow((line_no,) + tuple('' if value is None else value for value in values))
+            staged += 1
+
+        imported = 0
+        if staged:
+            buffer.seek(0)
+            imported = _copy_and_merge(buffer, report)
+
+    errors.sort(key=lambda error: error['line'])
+    return {'total': total, 'imported': imported, 'error_count': error_count, 'errors': errors}
+
+def _copy_and_merge(buffer, report):
+    connection = db.session.connection()
+    connection.execute(text('''
+        CREATE TEMP TABLE listings_import_staging (
+            line_no INT PRIMARY KEY,
+            seller_id INT NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            price NUMERIC(10, 2) NOT NULL,
+            description TEXT NOT NULL,
+            address TEXT NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            bedrooms INT,
+            bathrooms INT,
+            squarefootage INT,
+            duplicate BOOLEAN NOT NULL DEFAULT FALSE
+        ) ON COMMIT DROP
+    '''))
+
+    # COPY goes straight through the driver: one round trip for the whole file
+    with connection.connection.driver_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY listings_import_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+
+    connection.execute(text('CREATE INDEX ON listings_import_staging (seller_id, address, line_no)'))
+    connection.execute(text('ANALYZE listings_import_staging'))
+
+    duplicates = connection.execute(text('''
+        UPDATE listings_import_staging s SET duplicate = TRUE
+        WHERE EXISTS (SELECT 1 FROM listings l WHERE l.seller_id = s.seller_id AND l.address = s.address)
+           OR EXISTS (SELECT 1 FROM listings_import_staging d
+                      WHERE d.seller_id = s.seller_id AND d.address = s.address AND d.line_no < s.line_no)
+        RETURNING s.line_no
+    ''')).scalars().all()
+    for line_no in sorted(duplicates):
+        report(line_no, 'A listing with this seller and address already exists')
+
+    result = connection.execute(text('''
+        INSERT INTO listings (seller_id, title, price, description, address, status,
+                              bedrooms, bathrooms, squarefootage, created_at, version_id, offers_version)
+        SELECT seller_id, title, price, description, address, status,
+               bedrooms, bathrooms, squarefootage, now() AT TIME ZONE 'utc', 1, 1
+        FROM listings_import_staging
+        WHERE NOT duplicate
+        ORDER BY line_no
+    '''))
+    return result.rowcount
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from app import pubsub
+
+'''
+In-process caches for serialized listing payloads.
+Listings are read far more often than they change, and they only change through a handful of write
+paths; each of those calls invalidate_listing(), which clears this worker's caches once the
+transaction commits and tells every other worker to do the same over LISTEN/NOTIFY.
+'''
+
+LISTING_CHANGED_CHANNEL = 'listing_changed'
+ALL_LISTINGS = '*'  # Notification payload meaning every listing changed
+
+class _Flight:
+    """A load in progress; concurrent misses for the same key wait on it instead of hitting the database."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry time to live and single-flight loading."""
+
+    def __init__(self, max_size=1024, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}  # key -> _Flight
+        self._generation = 0  # Bumped on every invalidation, so loads that raced one are not stored
+        self._lock = threading.Lock()
+
+    def configure(self, max_size, ttl):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, calling loader() on a miss.
+        Only one caller per key runs the loader; the others wait for its result.
+        A loader returning None is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+                generation = self._generation
+
+        if not leader:
+            flight.done.wait()
+            if flight.failed:
+                return loader()  # Surface the error (or succeed) in this request too
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if not flight.failed and flight.value is not None and generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def prune(self, max_entries):
+        """Drop up to max_entries expired entries (they are otherwise only dropped when read). Returns how many."""
+        now = time.monotonic()
+        with self._lock:
+            expired = list(islice((key for key, (expires_at, _) in self._entries.items() if expires_at <= now), max_entries))
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+# Serialized listing payloads by listing id (get_listing_by_id)
+listing_cache = TTLCache()
+# Pages of the Buyer feed by (cursor, limit); any listing change can move rows between pages
+feed_cache = TTLCache()
+# Task progress cohort snapshots by role filter; expire on their TTL rather than on every completed task
+cohort_cache = TTLCache(max_size=8)
+
+def invalidate_listing(listing_id):
+    """Drop cached payloads for a listing in every worker once the current transaction commits."""
+    pubsub.publish(LISTING_CHANGED_CHANNEL, listing_id)
+
+def invalidate_all_listings():
+    """Drop every cached listing payload in every worker, e.g. after a bulk import."""
+    pubsub.publish(LISTING_CHANGED_CHANNEL, ALL_LISTINGS)
+
+def _on_listing_changed(payload):
+    if payload == ALL_LISTINGS:
+        listing_cache.clear()
+    else:
+        listing_cache.invalidate(int(payload))
+    feed_cache.clear()
+
+def _clear_all():
+    listing_cache.clear()
+    feed_cache.clear()
+
+def init_app(app):
+    listing_cache.configure(app.config['LISTING_CACHE_SIZE'], app.config['LISTING_CACHE_TTL'])
+    feed_cache.configure(app.config['LISTING_FEED_CACHE_SIZE'], app.config['LISTING_CACHE_TTL'])
+    cohort_cache.configure(cohort_cache.max_size, app.config['COHORT_STATS_CACHE_TTL'])
+    pubsub.subscribe(LISTING_CHANGED_CHANNEL, _on_listing_changed)
+    pubsub.on_reconnect(_clear_all)  # Changes made while disconnected were never announced to us
@@ -0,0 +1,120 @@
+import json
+import queue
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert
+from app import pubsub
+
+'''
+Per-user change events for the /events/stream Server-Sent Events endpoint.
+Write paths call emit() inside their transaction: the events are stored in app_events (so clients can
+resume from a Last-Event-ID) and announced over LISTEN/NOTIFY once the transaction commits. Each worker
+fans the announcements out to the streams of the users it is serving through an in-process broker.
+'''
+
+EVENTS_CHANNEL = 'app_events'
+
+class Subscription:
+    """One open stream: a bounded queue of events for a single user."""
+
+    def __init__(self, user_id, max_size):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=max_size)
+        self.overflowed = False  # Set when the client reads too slowly; the stream then ends and the client resumes
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+class Broker:
+    """Routes events to the subscriptions of their recipient in this worker."""
+
+    def __init__(self, max_seen=10000):
+        self._subscriptions = defaultdict(set)  # user_id -> {Subscription}
+        # Ids already delivered: a worker sees its own events twice, once locally and once over NOTIFY
+        self._seen = OrderedDict()
+        self._max_seen = max_seen
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, max_size=100):
+        subscription = Subscription(user_id, max_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, event):
+        with self._lock:
+            if event['id'] in self._seen:
+                return
+            self._seen[event['id']] = True
+            if len(self._seen) > self._max_seen:
+                self._seen.popitem(last=False)
+            subscriptions = list(self._subscriptions.get(event['user_id'], ()))
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.overflowed = True
+
+broker = Broker()
+
+def emit(event_type, user_ids, **data):
+    """
+    Record event_type for every user in user_ids; their streams receive it once the current transaction commits.
+    `data` should hold just the ids a client needs to refetch what changed.
+    """
+    from app import db
+    from app.models import Event
+
+    user_ids = sorted({user_id for user_id in user_ids if user_id})
+    if not user_ids:
+        return
+    rows = [{'user_id': user_id, 'event_type': event_type, 'data': data} for user_id in user_ids]
+    # One INSERT ... RETURNING and one NOTIFY statement however many recipients there are
+    created = db.session.execute(
+        insert(Event).returning(Event.id, Event.user_id, sort_by_parameter_order=True), rows
+    ).all()
+    pubsub.publish_many(EVENTS_CHANNEL, [
+        json.dumps({'id': event_id, 'user_id': user_id, 'type': event_type, 'data': data}, default=str)
+        for event_id, user_id in created
+    ])
+
+def to_dict(event):
+    """Serialize an Event row the way notifications carry it."""
+    return {'id': event.id, 'user_id': event.user_id, 'type': event.event_type, 'data': event.data}
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+def _on_event(payload):
+    broker.publish(json.loads(payload))
+
+events_cli = AppGroup('events', help='Change event maintenance.')
+
+@events_cli.command('purge')
+@click.option('--days', type=int, default=None, help='Keep this many days of events (default EVENTS_RETENTION_DAYS).')
+def purge(days):
+    """Delete events older than the retention period; clients cannot resume from further back anyway."""
+    from flask import current_app
+    from app import db
+    from app.models import Event
+
+    days = days if days is not None else current_app.config['EVENTS_RETENTION_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = db.session.execute(db.delete(Event).where(Event.created_at < cutoff)).rowcount
+    db.session.commit()
+    click.echo(f'Deleted {deleted} events older than {days} days')
+
+def init_app(app):
+    pubsub.subscribe(EVENTS_CHANNEL, _on_event)
+    app.cli.add_command(events_cli)
@@ -0,0 +1,149 @@
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+import click
+from flask import request, jsonify, make_response, current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert
+from app import db, unit_of_work
+
+'''
+Idempotency keys for state-changing POST endpoints.
+A client that may retry sends an Idempotency-Key header. The first request with a key claims it in
+idempotency_keys (committed on its own connection, so concurrent retries see the claim straight away), runs,
+and stores its response there; retries with the same key get that response back without the view running.
+'''
+
+def _table():
+    from app.models import IdempotencyKey
+    return IdempotencyKey.__table__
+
+def request_fingerprint():
+    """SHA-256 over what the request asks for, so a key reused for a different request can be refused."""
+    from app.storage import digest
+
+    sha256 = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    if request.form or request.files:
+        # Multipart bodies are not re-read; uploads were hashed while they were spooled
+        for name, value in sorted(request.form.items(multi=True)):
+            sha256.update(f'{name}={value}\n'.encode())
+        for name, file in sorted(request.files.items(multi=True), key=lambda item: (item[0], item[1].filename or '')):
+            sha256.update(f'{name}:{file.filename}:{digest(file.stream)[0]}\n'.encode())
+    else:
+        sha256.update(request.get_data())
+    return sha256.hexdigest()
+
+def _claim(endpoint, key, fingerprint):
+    """
+    Claim key for this request. Returns None when the claim succeeded, otherwise the row of the request
+    that holds the key.
+    """
+    table = _table()
+    config = current_app.config
+    now = datetime.utcnow()
+    values = {
+        'endpoint': endpoint,
+        'key': key,
+        'request_hash': fingerprint,
+        'status_code': None,
+        'response_body': None,
+        'response_mimetype': None,
+        'created_at': now,
+        'expires_at': now + timedelta(seconds=config['IDEMPOTENCY_KEY_TTL'])
+    }
+    this_key = (table.c.endpoint == endpoint) & (table.c.key == key)
+
+    with db.engine.begin() as connection:
+        claimed = connection.execute(
+            insert(table).values(**values).on_conflict_do_nothing(index_elements=['endpoint', 'key'])
+        ).rowcount
+        if claimed:
+            return None
+        row = connection.execute(select(table).where(this_key)).first()
+        if row is None:
+            return _claim(endpoint, key, fingerprint)  # Purged in between; try again
+
+        # Take over a key that expired, or whose request died before storing a response
+        abandoned = row.status_code is None and \
+            row.created_at < now - timedelta(seconds=config['IDEMPOTENCY_LOCK_TIMEOUT'])
+        if row.expires_at <= now or abandoned:
+            taken_over = connection.execute(
+                update(table).where(this_key, table.c.created_at == row.created_at).values(**values)
+            ).rowcount
+            if taken_over:
+                return None
+            row = connection.execute(select(table).where(this_key)).first()
+        return row
+
+def _store(endpoint, key, response):
+    table = _table()
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(table).where(table.c.endpoint == endpoint, table.c.key == key).values(
+                status_code=response.status_code,
+                response_body=response.get_data(),
+                response_mimetype=response.mimetype
+            )
+        )
+
+def _release(endpoint, key):
+    table = _table()
+    with db.engine.begin() as connection:
+        connection.execute(delete(table).where(table.c.endpoint == endpoint, table.c.key == key))
+
+def idempotent(view):
+    """
+    Make a POST view safe to retry. Requests without an Idempotency-Key header are not affected.
+    Responses below 500 are stored and replayed; server errors release the key so the client can retry.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+        if not 0 < len(key) <= 255:
+            return jsonify({'error': 'Idempotency-Key must be 1 to 255 characters'}), 400
+
+        endpoint = request.endpoint
+        fingerprint = request_fingerprint()
+        existing = _claim(endpoint, key, fingerprint)
+        if existing is not None:
+            if existing.request_hash != fingerprint:
+                return jsonify({'error': 'This Idempotency-Key was already used for a different request'}), 422
+            if existing.status_code is None:
+                return jsonify({'error': 'A request with this Idempotency-Key is still being processed'}), 409
+            response = current_app.response_class(
+                existing.response_body, status=existing.status_code, mimetype=existing.response_mimetype
+            )
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+            # Commit before storing, so a response is never replayed for work that did not commit
+            finished = unit_of_work.finish(response)
+        except Exception:
+            _release(endpoint, key)
+            raise
+        if finished is not response or finished.status_code >= 500:
+            # The commit failed (e.g. a 409 write conflict) or the view failed: nothing was saved, so the
+            # client must be able to retry with the same key rather than get this answer replayed
+            _release(endpoint, key)
+            return finished
+        _store(endpoint, key, response)
+        return response
+    return wrapper
+
+idempotency_cli = AppGroup('idempotency', help='Idempotency key maintenance.')
+
+@idempotency_cli.command('purge')
+def purge():
+    """Delete expired idempotency keys."""
+    table = _table()
+    with db.engine.begin() as connection:
+        deleted = connection.execute(delete(table).where(table.c.expires_at <= datetime.utcnow())).rowcount
+    click.echo(f'Deleted {deleted} expired idempotency keys')
+
+def init_app(app):
+    app.cli.add_command(idempotency_cli)
@@ -0,0 +1,156 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+'''
+Background derivative pipeline for listing photos.
+Uploading a photo only schedules the work; once the upload commits, a process pool renders resized,
+recompressed variants (thumbnail, card, full) and stores each one as a Document row linked to the original
+through parent_id. Listing payloads then point clients at the small variants.
+'''
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def render_variants(source, variants, quality):
+    """
+    Render every variant of one image; runs in a worker process.
+    `source` is a blob path or the image bytes. Returns {name: (jpeg bytes, width, height)}.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')  # Apply camera rotation, drop alpha for JPEG
+
+    rendered = {}
+    for name, (max_width, max_height) in variants.items():
+        variant = image.copy()
+        variant.thumbnail((max_width, max_height), Image.LANCZOS)  # Keeps the aspect ratio, never upscales
+        output = io.BytesIO()
+        variant.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+        rendered[name] = (output.getvalue(), variant.width, variant.height)
+    return rendered
+
+def _get_executor(max_workers):
+    # One pool per worker process; a pool inherited through fork would have no live processes
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor_pid = os.getpid()
+        return _executor
+
+def schedule_derivatives(document):
+    """Render variants of a photo Document in the background once the current transaction commits."""
+    from app import db
+
+    if document.id is None:
+        db.session.flush()
+    queue_derivatives(document.id, document.content_hash, document.codec, document.file_data)
+
+def queue_derivatives(document_id, content_hash, codec, file_data=None):
+    """Like schedule_derivatives, for photo rows inserted without ORM objects (see upload_photos)."""
+    from app import db
+    source = _render_source(content_hash, codec, file_data)
+    db.session.info.setdefault('pending_derivatives', []).append((document_id, source))
+
+def _render_source(content_hash, codec, file_data):
+    # Workers read plain blobs straight from disk; inline or compressed bytes are decoded here
+    from app.storage import blob_store_for_reads, decode
+
+    if file_data is not None:
+        return decode(file_data, codec)
+    store = blob_store_for_reads()
+    return store.read(content_hash, codec) if codec else store.path_for(content_hash)
+
+@event.listens_for(Session, 'after_commit')
+def _submit_committed(session):
+    pending = session.info.pop('pending_derivatives', None)
+    if pending:
+        from flask import current_app
+        app = current_app._get_current_object()
+        for document_id, source in pending:
+            future = submit(app, document_id, source)
+            future.add_done_callback(lambda finished, document_id=document_id: _store_variants(app, document_id, finished))
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('pending_derivatives', None)
+
+def submit(app, document_id, source):
+    """Queue rendering of one photo on the process pool and return its future."""
+    executor = _get_executor(app.config['PHOTO_VARIANT_WORKERS'])
+    return executor.submit(render_variants, source, app.config['PHOTO_VARIANTS'], app.config['PHOTO_VARIANT_QUALITY'])
+
+def _store_variants(app, document_id, future):
+    from app import db
+    from app.models import Document
+
+    try:
+        rendered = future.result()
+    except Exception:
+        logger.exception('Rendering variants of document %s failed', document_id)
+        return
+
+    with app.app_context():
+        try:
+            original = db.session.get(Document, document_id)
+            if original is None:
+                return  # Deleted while we were rendering
+            existing = {variant.variant for variant in original.variants}
+            stem = os.path.splitext(original.file_name)[0]
+            for name, (data, width, height) in rendered.items():
+                if name in existing:
+                    continue
+                variant = Document(
+                    listing_id=None,  # Variants hang off their original, not the listing
+                    uploaded_by=original.uploaded_by,
+                    document_type='PhotoVariant',
+                    file_name=f'{stem}_{name}.jpg',
+                    file_data=data,
+                    mime_type='image/jpeg'
+                )
+                variant.variant = name
+                variant.width = width
+                variant.height = height
+                original.variants.append(variant)
+            if original.listing_id:
+                from app.cache import invalidate_listing
+                original.listing.touch()
+                invalidate_listing(original.listing_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception('Storing variants of document %s failed', document_id)
+
+images_cli = AppGroup('images', help='Photo derivative maintenance.')
+
+@images_cli.command('generate-variants')
+def generate_variants():
+    """Render variants for photos that do not have them yet, e.g. photos uploaded before the pipeline existed."""
+    from flask import current_app
+    from app.models import Document
+
+    app = current_app._get_current_object()
+    photos = Document.query.filter(Document.document_type == 'Photo', ~Document.variants.any()).all()
+    futures = []
+    for photo in photos:
+        file_data = photo.file_data if photo.stored_inline else None  # Only load bytes that are in the row
+        source = _render_source(photo.content_hash, photo.codec, file_data)
+        futures.append((photo.id, submit(app, photo.id, source)))
+    for document_id, future in futures:
+        _store_variants(app, document_id, future)  # Waits for the render; failures are logged
+    click.echo(f'Rendered variants for {len(futures)} photos')
+
+def init_app(app):
+    app.cli.add_command(images_cli)
@@ -1,12 +1,13 @@
 from app import db
 from datetime import datetime, timezone
-from sqlalchemy.dialects.postgresql import JSONB
-from flask_bcrypt import Bcrypt
-from app.routes.tasks import TASK_SEQUENCES
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import deferred
+from sqlalchemy.orm.attributes import flag_modified
+from app.routes.tasks import task_mask, progress_from_bits
+from app.storage import attach_file
+from app.passwords import hasher
 
 
-bcrypt = Bcrypt()
-
 class TestModel(db.Model):
     __tablename__ = 'test'
     
@@ -26,28 +27,49 @@ class User(db.Model):
     email = db.Column(db.String(100), unique=True)  # Email must be unique
     password_hash = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
-    task_progress = db.Column(JSONB, default={})  # Task progress stored as JSON
+    # Completed tasks as a bitmask over TASK_SEQUENCES[role] (see app/routes/tasks.py); task_progress is the JSON view
+    task_progress_bits = db.Column(db.BigInteger, nullable=False, default=0)
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))  # Foreign key to Roles table
-    role = db.relationship('Role', backref='users', lazy=True)  # Relationship to Role
+    role = db.relationship('Role', backref='users', lazy='joined')  # Relationship to Role, joined since every route checks it
+    version_id = db.Column(db.Integer, nullable=False)  # Bumped on every update; ETag for task progress
+
+    __mapper_args__ = {'version_id_col': version_id}
+    # Cohort stats read (role_id, task_progress_bits) with an index-only scan
+    __table_args__ = (db.Index('idx_users_role_task_progress', 'role_id', 'task_progress_bits'),)
 
     def __init__(self, name, email, password_hash=None, role=None):
         self.name = name
         self.email = email
         self.password_hash = password_hash
         self.role = role  # only one role is assigned
-        self.task_progress = self.initialize_task_progress(role)
+        self.task_progress_bits = 0  # Nothing completed yet
 
     def hash_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = hasher.hash(password)  # On the hashing pool; see app/passwords.py
 
     def check_password_hash(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return hasher.check(password, self.password_hash)
     
-    def initialize_task_progress(self, role):
-        task_progress = {}
-        if role and role.role_name in TASK_SEQUENCES:
-            task_progress[role.role_name] = {task: False for task in TASK_SEQUENCES[role.role_name]}
-        return task_progress
+    @property
+    def task_progress(self):
+        """Progress in the shape the API has always returned: {role_name: {task_name: bool}}."""
+        if not self.role:
+            return {}
+        role_name = self.role.role_name
+        return {role_name: progress_from_bits(role_name, self.task_progress_bits or 0)}
+
+    def complete_tasks(self, *task_names):
+        """
+        Mark tasks of the user's role completed with a single UPDATE ... SET task_progress_bits = task_progress_bits | mask.
+        The OR happens in the database, so concurrent completions never overwrite each other. Returns the new bitmask.
+        """
+        mask = task_mask(self.role.role_name, task_names)
+        return db.session.execute(
+            db.update(User).where(User.id == self.id)
+            .values(task_progress_bits=User.task_progress_bits.op('|')(mask), version_id=User.version_id + 1)
+            .returning(User.task_progress_bits)
+            .execution_options(synchronize_session='fetch')
+        ).scalar_one()
 
 class Listing(db.Model):
     __tablename__ = 'listings'
@@ -63,9 +85,21 @@ class Listing(db.Model):
     
     seller = db.relationship('User', backref='listings', lazy=True)  # Relationship to User (Seller)
     documents = db.relationship('Document', back_populates='listing', lazy=True)  # Relationship to Documents
+    offer_stats = db.relationship('ListingOfferStats', uselist=False, lazy=True, viewonly=True)  # Summary of offers
     bedrooms = db.Column(db.Integer, nullable=True)
     bathrooms = db.Column(db.Integer, nullable=True)
     squarefootage = db.Column(db.Integer, nullable=True)
+    version_id = db.Column(db.Integer, nullable=False)  # Bumped on every update; ETag and optimistic locking
+    offers_version = db.Column(db.Integer, nullable=False, default=1)  # Bumped whenever an offer on this listing changes
+    # Full-text search document over title (weight A) and description (weight B), maintained by Postgres.
+    # Deferred so it is never loaded into Python; it is only used in WHERE/ORDER BY of text searches.
+    search_vector = deferred(db.Column(TSVECTOR, db.Computed(
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+        persisted=True
+    )))
+
+    __mapper_args__ = {'version_id_col': version_id}
 
     def __init__(self, seller_id, title, price, description, address, status='Pending Approval'):
         self.seller_id = seller_id
@@ -75,6 +109,10 @@ class Listing(db.Model):
         self.address = address
         self.status = status
 
+    def touch(self):
+        """Bump the version when rows embedded in the listing payload (its documents) change."""
+        flag_modified(self, 'status')
+
 class Offer(db.Model):
     __tablename__ = 'offers'
 
@@ -96,6 +134,19 @@ class Offer(db.Model):
         self.offer_message = offer_message
         self.status = status
 
+class ListingOfferStats(db.Model):
+    """Running summary of the offers on a listing, kept current by submit_offer and respond_offer."""
+    __tablename__ = 'listing_offer_stats'
+
+    listing_id = db.Column(db.Integer, db.ForeignKey('listings.id', ondelete='CASCADE'), primary_key=True)
+    offer_count = db.Column(db.Integer, nullable=False, default=0)  # Offers ever received
+    pending_count = db.Column(db.Integer, nullable=False, default=0)  # Offers still awaiting a response
+    highest_offer = db.Column(db.Numeric(10, 2))
+    lowest_offer = db.Column(db.Numeric(10, 2))
+    latest_offer_id = db.Column(db.Integer, db.ForeignKey('offers.id', ondelete='SET NULL'))
+    latest_offer_price = db.Column(db.Numeric(10, 2))
+    latest_offer_at = db.Column(db.DateTime)
+
 class Document(db.Model):
     __tablename__ = 'documents'
     
@@ -104,18 +155,34 @@ class Document(db.Model):
     uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))  # Foreign key to Users table
     document_type = db.Column(db.String(50), nullable=False)  # Type of document (e.g., Notification, Photo)
     file_name = db.Column(db.String(255), nullable=False)  # Original file name
-    file_data = db.Column(db.LargeBinary, nullable=False)  # Binary data of the file
+    file_data = deferred(db.Column(db.LargeBinary, nullable=True))  # Inline bytes, only for the 'database' storage backend and legacy rows; loaded on access
+    content_hash = db.Column(db.String(64))  # SHA-256 of the file; key into the blob store
+    file_size = db.Column(db.BigInteger)  # Size of the file in bytes
+    mime_type = db.Column(db.String(255))  # MIME type of the file
+    codec = db.Column(db.String(10))  # Compression of the stored bytes (gzip, zstd); NULL if stored as-is
+    stored_size = db.Column(db.BigInteger)  # Bytes actually stored, after compression
     uploaded_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))  # Timestamp for when the document was uploaded
+    stored_inline = db.column_property(file_data.expression.isnot(None))  # Whether the bytes are in file_data, without loading them
+    parent_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'))  # Original photo this variant was derived from
+    variant = db.Column(db.String(20))  # Variant name for derived images (thumbnail, card, full)
+    width = db.Column(db.Integer)  # Pixel size of derived images
+    height = db.Column(db.Integer)
     
     listing = db.relationship('Listing', back_populates='documents')  # Relationship to Listing
+    variants = db.relationship('Document', backref=db.backref('parent', remote_side=[id]),
+                               cascade='all, delete-orphan', lazy=True)  # Resized copies of a photo
     uploader = db.relationship('User', backref='uploaded_documents', lazy=True)  # Relationship to User (Uploader)
 
-    def __init__(self, listing_id, uploaded_by, document_type, file_name, file_data):
+    def __init__(self, listing_id, uploaded_by, document_type, file_name, file_data, mime_type=None):
         self.listing_id = listing_id
         self.uploaded_by = uploaded_by
         self.document_type = document_type
         self.file_name = file_name
-        self.file_data = file_data
+        self.set_content(file_data, mime_type)
+
+    def set_content(self, file_data, mime_type=None):
+        """Store the file through the configured storage backend and record its hash, size and MIME type."""
+        attach_file(self, file_data, mime_type)
 
 class Escrow(db.Model):
     __tablename__ = 'escrow'
@@ -136,3 +203,29 @@ class Escrow(db.Model):
         self.seller_id = seller_id
         self.escrow_number = escrow_number
         self.status = status
+
+class Event(db.Model):
+    __tablename__ = 'app_events'
+
+    id = db.Column(db.BigInteger, primary_key=True)  # Also the SSE event id clients resume from
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)  # Recipient
+    event_type = db.Column(db.String(50), nullable=False)  # e.g. offer_submitted, listing_approved
+    data = db.Column(JSONB, nullable=False, default=dict)  # Ids the client needs to refetch what changed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('idx_app_events_user', 'user_id', 'id'),)
+
+class IdempotencyKey(db.Model):
+    """A claimed Idempotency-Key and, once the request finished, the response to replay for it."""
+    __tablename__ = 'idempotency_keys'
+
+    endpoint = db.Column(db.String(100), primary_key=True)  # Keys are scoped per endpoint
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)  # Fingerprint of the request that claimed the key
+    status_code = db.Column(db.Integer)  # NULL while the request is still running
+    response_body = db.Column(db.LargeBinary)
+    response_mimetype = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index('idx_idempotency_keys_expires', 'expires_at'),)
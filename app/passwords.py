@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from flask import jsonify
+
+'''
+Password hashing off the request worker.
+bcrypt is deliberately slow (about a quarter of a second per hash at cost 12) and holds the CPU the whole
+time, so running it inline lets a burst of logins starve every other request in the worker. Hashes and
+checks run on a small process pool instead; the request waits for the result without holding the CPU
+(under gevent, other greenlets keep running). The number of hashes queued at once is bounded, and requests
+beyond that get a 503 with Retry-After rather than piling up behind each other.
+'''
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool already has as much queued work as it is allowed."""
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def hash_rounds(password_hash):
+    """Cost factor stored in a bcrypt hash ('$2b$12$...' -> 12), or None if it is not a bcrypt hash."""
+    parts = (password_hash or '').split('$')
+    try:
+        return int(parts[2])
+    except (IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    """bcrypt on a bounded process pool, one pool per worker process."""
+
+    def __init__(self, rounds=12, workers=None, max_pending=None, wait_timeout=1.0):
+        self.configure(rounds, workers, max_pending, wait_timeout)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, rounds, workers=None, max_pending=None, wait_timeout=1.0):
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def _get_executor(self):
+        # A pool inherited through fork would have no live processes
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        # Wait briefly for a free slot, then give up so the client can back off and retry
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise PasswordHasherBusy()
+        try:
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, password, password_hash):
+        if not password_hash:
+            return False
+        return self._run(_check, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        """True when password_hash was made with a different cost than BCRYPT_LOG_ROUNDS."""
+        return hash_rounds(password_hash) != self.rounds
+
+hasher = PasswordHasher()
+
+def _hasher_busy(e):
+    response = jsonify({'error': 'Too many sign-ins in progress, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def init_app(app):
+    config = app.config
+    hasher.configure(
+        config['BCRYPT_LOG_ROUNDS'],
+        config['PASSWORD_HASH_WORKERS'],
+        config['PASSWORD_HASH_MAX_PENDING'],
+        config['PASSWORD_HASH_WAIT_TIMEOUT']
+    )
+    app.register_error_handler(PasswordHasherBusy, _hasher_busy)
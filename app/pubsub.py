@@ -0,0 +1,128 @@
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+'''
+Cross-worker notifications over Postgres LISTEN/NOTIFY.
+publish() queues a NOTIFY inside the current transaction, so other workers only hear about changes that
+actually committed. Handlers in this worker run right after the commit; every other worker gets the
+notification through a single background listener connection per process.
+'''
+
+logger = logging.getLogger(__name__)
+
+_handlers = defaultdict(list)  # channel -> [handler(payload)]
+_reconnect_handlers = []  # called after the listener (re)connects, since notifications may have been missed
+_listener_pid = None  # Process that started the listener; gunicorn workers each need their own
+_listener_lock = threading.Lock()
+
+def subscribe(channel, handler):
+    """Call handler(payload) for every committed notification on channel, from any worker."""
+    if handler not in _handlers[channel]:
+        _handlers[channel].append(handler)
+
+def on_reconnect(handler):
+    """Call handler() whenever the listener (re)connects and may have missed notifications."""
+    if handler not in _reconnect_handlers:
+        _reconnect_handlers.append(handler)
+
+def publish(channel, payload):
+    """Notify every worker about a change once the current transaction commits."""
+    from app import db
+    payload = str(payload)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': channel, 'payload': payload})
+    db.session.info.setdefault('pending_notifications', []).append((channel, payload))
+
+def publish_many(channel, payloads):
+    """publish() several payloads with a single statement."""
+    from app import db
+    payloads = [str(payload) for payload in payloads]
+    if not payloads:
+        return
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(
+            text('SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload'),
+            {'channel': channel, 'payloads': payloads}
+        )
+    db.session.info.setdefault('pending_notifications', []).extend((channel, payload) for payload in payloads)
+
+def _dispatch(channel, payload):
+    for handler in _handlers.get(channel, []):
+        try:
+            handler(payload)
+        except Exception:
+            logger.exception('Notification handler for %s failed', channel)
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_committed(session):
+    # Apply our own changes immediately instead of waiting for the NOTIFY round trip
+    for channel, payload in session.info.pop('pending_notifications', []):
+        _dispatch(channel, payload)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('pending_notifications', None)
+
+class Listener(threading.Thread):
+    """Background thread holding one LISTEN connection per worker process."""
+
+    def __init__(self, engine, poll_timeout=5.0, retry_delay=1.0):
+        super().__init__(name='pubsub-listener', daemon=True)
+        self.engine = engine
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Notification listener lost its connection, reconnecting')
+                time.sleep(self.retry_delay)
+
+    def _listen(self):
+        # Detach from the pool: this connection lives as long as the worker does
+        connection = self.engine.raw_connection()
+        connection.detach()
+        dbapi_connection = connection.driver_connection
+        try:
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                for channel in list(_handlers):
+                    cursor.execute(f'LISTEN "{channel}"')
+            for handler in _reconnect_handlers:
+                handler()
+            logger.info('Listening for notifications on %s', ', '.join(_handlers))
+            while True:
+                if select.select([dbapi_connection], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    _dispatch(notification.channel, notification.payload)
+        finally:
+            dbapi_connection.close()
+
+def start_listener():
+    """Start this worker's listener thread if it is not running yet (safe to call on every request)."""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    from app import db
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        if db.engine.dialect.name == 'postgresql':  # Single-process development databases only need the local dispatch
+            Listener(db.engine).start()
+
+def init_app(app):
+    """Start the listener lazily in each worker, after gunicorn has forked."""
+    if app.config['PUBSUB_ENABLED']:
+        app.before_request(start_listener)
@@ -17,7 +17,7 @@ def test_db():
         # Create a test record
         test_record = TestModel(name="test_connection")
         db.session.add(test_record)
-        db.session.commit()
+        db.session.flush()
         
         # Query the record
         result = TestModel.query.first()
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, session
 from app.models import db, User, Role
 from app.utils import login_required
+from app.passwords import hasher
 from sqlalchemy import exc
 
 auth_bp = Blueprint('auth', __name__)
@@ -37,15 +38,12 @@ def register():
     # Create a new User instance and hash the password
     new_user = User(name=name, email=email)
     new_user.hash_password(password)
-    new_user.role = role  # Assign the single role to the user
-
-    # Initialize task progress based on the assigned role
-    new_user.task_progress = new_user.initialize_task_progress(role)
+    new_user.role = role  # Assign the single role to the user (task progress starts empty)
 
     # Add the new user to the database
     try:
         db.session.add(new_user)
-        db.session.commit()
+        db.session.flush()  # Surfaces a failed INSERT here; the request commits it afterwards
         return jsonify({'message': 'User created successfully', 'user_id': new_user.id, 'role': role_name}), 201
     except exc.SQLAlchemyError as e:
         db.session.rollback()  # Rollback in case of error
@@ -69,6 +67,10 @@ def login():
     if not user or not user.check_password_hash(password):
         return jsonify({'error': 'Invalid credentials'}), 401
 
+    # Upgrade hashes made with an older BCRYPT_LOG_ROUNDS while we have the plain password
+    if hasher.needs_rehash(user.password_hash):
+        user.hash_password(password)
+
     # Get the user's role
     user_role = user.role.role_name
 
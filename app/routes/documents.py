@@ -1,27 +1,127 @@
-import base64
-from flask import Blueprint, request, jsonify
+import hashlib
+import hmac
+import os
+import time
+from flask import Blueprint, request, jsonify, current_app, send_file, url_for, Response
 from app.models import db, User, Listing, Document 
 from app.utils import login_required
-from sqlalchemy.orm.attributes import flag_modified
+from app.cache import invalidate_listing
+from app.storage import file_source, guess_mime_type
+from app.routes.tasks import check_transition
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 
 documents_bp = Blueprint('documents', __name__)
 
+def url_epoch():
+    """Number of the current DOCUMENT_URL_TTL window; signed URLs change only when it does."""
+    return int(time.time()) // current_app.config['DOCUMENT_URL_TTL']
+
+def _signature(document_id, expires):
+    key = current_app.config['SECRET_KEY'].encode()
+    return hmac.new(key, f'document:{document_id}:{expires}'.encode(), hashlib.sha256).hexdigest()
+
+def signed_content_url(document_id):
+    """
+    Return a URL for a document's bytes, signed with SECRET_KEY.
+    Expiry is aligned to DOCUMENT_URL_TTL windows and always at least one window away, so cached listing
+    payloads stay byte-for-byte identical (and ETags stable) within a window and never hand out dead links.
+    """
+    expires = (url_epoch() + 2) * current_app.config['DOCUMENT_URL_TTL']
+    return url_for('documents.get_document_content', document_id=document_id,
+                   expires=expires, signature=_signature(document_id, expires))
+
+def valid_signature(document_id, expires, signature):
+    if not (expires and signature):
+        return False
+    try:
+        expires = int(expires)
+    except ValueError:
+        return False
+    return expires > time.time() and hmac.compare_digest(
+        _signature(document_id, expires).encode(), signature.encode('utf-8')  # Bytes, as str only compares ASCII
+    )
+
 def format_document(document):
     """
-    Format a document's data for inclusion in the listing response with Base64 encoded file content.
+    Format a document's metadata for inclusion in the listing response.
+    The bytes are not embedded; clients fetch them lazily from `content_url`, a signed, expiring URL.
     """
-    # Encode file data as Base64
-    file_content_base64 = base64.b64encode(document.file_data).decode('utf-8')
-    
     return {
         'id': document.id,
         'document_type': document.document_type,
         'file_name': document.file_name,
+        'mime_type': document.mime_type,
+        'file_size': document.file_size,
         'uploaded_by': document.uploaded_by,
         'uploaded_at': document.uploaded_at,
-        'file_content': file_content_base64  # Include Base64 encoded file content
+        'content_url': signed_content_url(document.id),
+        # Resized copies of photos; clients render 'thumbnail' or 'card' and only fetch the original on demand
+        'variants': {
+            variant.variant: {
+                'content_url': signed_content_url(variant.id),
+                'width': variant.width,
+                'height': variant.height
+            }
+            for variant in document.variants
+        }
     }
 
+@documents_bp.route('/<int:document_id>/content', methods=['GET'])
+#@login_required
+def get_document_content(document_id):
+    """
+    Stream the raw bytes of a document.
+    The URL must carry a valid `expires`/`signature` pair from signed_content_url (as listing payloads do).
+    Supports Range requests (partial content), and sends Content-Length, ETag and caching headers so clients
+    only download what they render and revalidate cheaply. With DOCUMENT_SERVE_MODE 'x-accel' or
+    'x-sendfile' the transfer itself is handed to the front proxy once the request is authorized.
+    """
+    if current_app.config['DOCUMENT_URLS_REQUIRE_SIGNATURE'] and \
+            not valid_signature(document_id, request.args.get('expires'), request.args.get('signature')):
+        return jsonify({'error': 'Invalid or expired document URL'}), 403
+
+    document = db.session.get(Document, document_id)
+    if not document:
+        return jsonify({'error': 'Document not found'}), 404
+
+    source = file_source(document)
+    mimetype = document.mime_type or guess_mime_type(document.file_name)
+    max_age = current_app.config['DOCUMENT_CACHE_MAX_AGE']
+
+    if current_app.config['DOCUMENT_SERVE_MODE'] == 'x-accel' and isinstance(source, str):
+        # nginx serves the blob from an internal location, including Range and conditional requests
+        relative_path = os.path.relpath(source, current_app.config['DOCUMENT_STORAGE_ROOT'])
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = current_app.config['DOCUMENT_ACCEL_PREFIX'] + relative_path
+        response.headers.set('Content-Disposition', 'inline', filename=document.file_name)
+        response.cache_control.max_age = max_age
+        response.cache_control.private = True
+        return response
+
+    # Plain blobs are passed by path: gunicorn copies them with sendfile(2), or with USE_X_SENDFILE
+    # ('x-sendfile' mode) the front server does. Inline and compressed documents are streamed by Python.
+    response = send_file(
+        source,
+        mimetype=mimetype,
+        download_name=document.file_name,
+        conditional=not document.codec,  # Handles Range and If-None-Match / If-Modified-Since
+        etag=document.content_hash or True,
+        last_modified=document.uploaded_at,
+        max_age=max_age
+    )
+    if document.codec:
+        # send_file cannot size a decompressing reader; the original size is on the row
+        response.content_length = document.file_size
+        try:
+            response.make_conditional(request.environ, accept_ranges=True, complete_length=document.file_size)
+        except RequestedRangeNotSatisfiable:
+            response.close()
+            raise
+    # Documents are per-user content: browsers may cache them, shared proxies may not
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
 @documents_bp.route('/gather_disclosure_documents', methods=['POST'])
 #@login_required
 def gather_disclosure_documents():
@@ -46,28 +146,29 @@ def gather_disclosure_documents():
     if not listing:
         return jsonify({'error': 'Listing not found'}), 404
 
+    # Ensure the previous task (approve_listing_in_fsh) is completed
+    error = check_transition(user, 'gather_disclosure_documents')
+    if error:
+        return error
+
     # Save the document to the Documents table
     file_name = file.filename
-    file_data = file.read()
+    file_data = file.stream  # Spooled upload, streamed into storage
 
     new_document = Document(
         listing_id=listing.id,
         uploaded_by=user.id,
         document_type='Disclosure',
         file_name=file_name,
-        file_data=file_data
+        file_data=file_data,
+        mime_type=file.mimetype
     )
     db.session.add(new_document)
-    db.session.commit()
-
-    # Update task progress for the FSH
-    task_progress = user.task_progress.get('FSH', {})
-    task_progress['gather_disclosure_documents'] = True
-    user.task_progress['FSH'] = task_progress
+    listing.touch()
+    invalidate_listing(listing.id)  # Listing payloads embed their documents
 
-    # Save changes to the database
-    flag_modified(user, 'task_progress')
-    db.session.commit()
+    # Update task progress for the FSH (the document and the progress commit together after the request)
+    user.complete_tasks('gather_disclosure_documents')
 
     # Return success response
     return jsonify({'message': 'Disclosure document uploaded successfully', 'document_id': new_document.id}), 201
@@ -1,13 +1,16 @@
 import base64
 from flask import Blueprint, request, jsonify
-from app.models import db, User, Listing, Escrow
+from app.models import db, User, Listing, Escrow, Offer
+from app.events import emit
+from app.idempotency import idempotent
+from app.routes.tasks import check_transition
 from app.utils import login_required
-from sqlalchemy.orm.attributes import flag_modified
 
 escrow_bp = Blueprint('escrow', __name__)
 
 @escrow_bp.route('/open_escrow', methods=['POST'])
 #@login_required
+@idempotent
 def open_escrow():
     """
     FSH agent opens escrow for a listing and provides the escrow number.
@@ -31,6 +34,11 @@ def open_escrow():
     if not listing:
         return jsonify({'error': 'Listing not found'}), 404
 
+    # Ensure the previous task (gather_disclosure_documents) is completed
+    error = check_transition(user, 'open_escrow')
+    if error:
+        return error
+
     # Ensure escrow doesn't already exist for this listing
     existing_escrow = Escrow.query.filter_by(listing_id=listing_id).first()
     if existing_escrow:
@@ -44,16 +52,17 @@ def open_escrow():
         status="Open"  # Set initial status to "Open"
     )
     db.session.add(new_escrow)
-    db.session.commit()
+    db.session.flush()  # Assigns the escrow id for the event and the response
 
     # Update task progress for the FSH
-    task_progress = user.task_progress.get('FSH', {})
-    task_progress['open_escrow'] = True
-    user.task_progress['FSH'] = task_progress
+    user.complete_tasks('open_escrow')
 
-    # Save changes to the database
-    flag_modified(user, 'task_progress')
-    db.session.commit()
+    # Tell the seller, the buyer whose offer was accepted and the agent
+    buyer_id = db.session.scalar(
+        db.select(Offer.buyer_id).where(Offer.listing_id == listing.id, Offer.status == 'Accepted')
+    )
+    emit('escrow_opened', [listing.seller_id, buyer_id, user.id], listing_id=listing.id, escrow_id=new_escrow.id)
+    emit('task_completed', [user.id], role='FSH', task_name='open_escrow')
 
     # Return success response
     return jsonify({'message': 'Escrow opened successfully', 'escrow_id': new_escrow.id}), 201
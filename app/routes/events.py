@@ -0,0 +1,62 @@
+import queue
+from flask import Blueprint, request, jsonify, Response, current_app
+from app.models import db, User, Event
+from app.events import broker, format_sse, to_dict
+
+events_bp = Blueprint('events', __name__)
+
+@events_bp.route('/stream', methods=['GET'])
+#@login_required
+def stream():
+    """
+    Server-Sent Events stream of the user's offer, listing, escrow and task changes.
+    Replaces polling get_offers_for_listing, get_my_offers and get_task_progress: refetch when an event arrives.
+    Reconnecting clients send Last-Event-ID (browsers do this automatically) and get the events they missed.
+    Run under gevent workers (see gunicorn.conf.py) so idle streams cost a greenlet, not a thread.
+    """
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    if db.session.get(User, user_id) is None:
+        return jsonify({'error': 'User not found'}), 404
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+
+    config = current_app.config
+    # Subscribe before reading the backlog, so events committed in between are not lost
+    subscription = broker.subscribe(user_id, config['EVENTS_QUEUE_SIZE'])
+    missed = []
+    if last_event_id is not None:
+        missed = [to_dict(event) for event in Event.query
+                  .filter(Event.user_id == user_id, Event.id > last_event_id)
+                  .order_by(Event.id).limit(config['EVENTS_REPLAY_LIMIT'])]
+    db.session.remove()  # Give the connection back to the pool; the stream itself never touches the database
+    heartbeat = config['EVENTS_HEARTBEAT_INTERVAL']
+
+    def generate():
+        try:
+            yield f"retry: {config['EVENTS_RETRY_MS']}\n\n"
+            replayed = set()
+            for event in missed:
+                replayed.add(event['id'])
+                yield format_sse(event)
+            while not subscription.overflowed:
+                try:
+                    event = subscription.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keepalive\n\n'  # Keeps proxies from closing an idle connection
+                    continue
+                if event['id'] not in replayed:
+                    yield format_sse(event)
+            # The client fell behind; ending the stream makes it reconnect and resume from its last id
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let nginx pass events through as they are written
+    return response
@@ -1,11 +1,64 @@
-from flask import Blueprint, request, jsonify
+from decimal import Decimal
+import click
+from flask import Blueprint, request, jsonify, Response, current_app, stream_with_context
 from app.models import db, User, Listing, Document 
-from app.utils import login_required
-from app.routes.documents import format_document
-from sqlalchemy.orm.attributes import flag_modified
+from app.utils import login_required, keyset_paginate, page_limit, with_next_cursor, query_budget, not_modified
+from sqlalchemy.orm.exc import StaleDataError
+from app.routes.documents import format_document, url_epoch
+from app.routes.offers import format_offer_stats
+from app.routes.tasks import check_transition
+from app.images import schedule_derivatives, queue_derivatives
+from app.storage import store_file
+from app.events import emit
+from app.idempotency import idempotent
+from app.cache import listing_cache, feed_cache, invalidate_listing, invalidate_all_listings
+from app.bulk_import import IMPORT_FORMATS, detect_format, import_listings
+from sqlalchemy import func, insert
+from sqlalchemy.orm import joinedload, selectinload
 
 listings_bp = Blueprint('listings', __name__)
 
+# Loader options for listing payloads: documents of a whole page, then their photo variants, in two queries;
+# offer stats joined into the listing query itself
+LISTING_LOADERS = (
+    selectinload(Listing.documents).selectinload(Document.variants),
+    joinedload(Listing.offer_stats),
+)
+
+def format_listing(listing):
+    """
+    Format a listing with its documents for the listing feeds.
+    """
+    return {
+        'id': listing.id,
+        'title': listing.title,
+        'price': listing.price,
+        'description': listing.description,
+        'address': listing.address,
+        'status': listing.status,
+        'created_at': listing.created_at,
+        'documents': [format_document(doc) for doc in listing.documents],
+        'bedrooms': listing.bedrooms,
+        'bathrooms': listing.bathrooms,
+        'squarefootage': listing.squarefootage,
+        'offer_stats': format_offer_stats(listing.offer_stats),
+        'version': listing.version_id
+    }
+
+def stream_listings(query):
+    """
+    Yield `query` as a JSON array, one listing at a time.
+    Rows are pulled through a server-side cursor in batches of LISTING_STREAM_BATCH_SIZE, so only one
+    batch of listings (and their documents) is ever held in memory.
+    """
+    batch_size = current_app.config['LISTING_STREAM_BATCH_SIZE']
+    yield '['
+    for index, listing in enumerate(query.order_by(Listing.created_at, Listing.id).yield_per(batch_size)):
+        if index:
+            yield ','
+        yield current_app.json.dumps(format_listing(listing))
+    yield ']'
+
 @listings_bp.route('/notify_fsh', methods=['POST'])
 #@login_required
 def notify_fsh():
@@ -25,24 +78,20 @@ def notify_fsh():
 
     # Upload document to the Documents table
     file_name = file.filename
-    file_data = file.read()  # Read the file as binary
+    file_data = file.stream  # Spooled to disk while the request was parsed; storage copies it in chunks
 
     new_document = Document(
         listing_id=None,  # No listing yet; this is a notification
         uploaded_by=user.id,
         document_type='Notification',
         file_name=file_name,
-        file_data=file_data
+        file_data=file_data,
+        mime_type=file.mimetype
     )
     db.session.add(new_document)
-    db.session.commit()
 
-    # Update task progress for the Seller
-    task_progress = user.task_progress.get('Seller', {})
-    task_progress['notify_fsh_intent_to_sell'] = True
-    user.task_progress['Seller'] = task_progress
-    flag_modified(user, 'task_progress')
-    db.session.commit()
+    # Update task progress for the Seller (flushes the document first, assigning its id)
+    user.complete_tasks('notify_fsh_intent_to_sell')
 
     return jsonify({'message': 'FSH notified of intent to sell successfully', 'document_id': new_document.id}), 201
 
@@ -63,20 +112,18 @@ def prepare_home():
         return jsonify({'error': 'Invalid user or role'}), 403
 
     # Ensure the previous task (notify_fsh_intent_to_sell) is completed
-    task_progress = user.task_progress.get('Seller', {})
-    if not task_progress.get('notify_fsh_intent_to_sell', False):
-        return jsonify({'error': 'You must notify FSH before preparing the home'}), 400
+    error = check_transition(user, 'prepare_home_for_listing', message='You must notify FSH before preparing the home')
+    if error:
+        return error
 
     # Mark the property as photo-ready
-    task_progress['prepare_home_for_listing'] = True
-    user.task_progress['Seller'] = task_progress
-    flag_modified(user, 'task_progress')
-    db.session.commit()
+    user.complete_tasks('prepare_home_for_listing')
 
     return jsonify({'message': 'Home marked as photo-ready'}), 200
 
 @listings_bp.route('/upload_photo', methods=['POST'])
 #@login_required
+@idempotent
 def upload_photo():
     """
     Upload a single photo for the listing.
@@ -93,13 +140,13 @@ def upload_photo():
         return jsonify({'error': 'Invalid user or role'}), 403
 
     # Ensure the previous task (prepare_home_for_listing) is completed
-    task_progress = user.task_progress.get('Seller', {})
-    if not task_progress.get('prepare_home_for_listing', False):
-        return jsonify({'error': 'You must prepare the home before uploading a photo'}), 400
+    error = check_transition(user, 'provide_photo_for_listing', message='You must prepare the home before uploading a photo')
+    if error:
+        return error
 
     # Upload the photo as binary data
     file_name = file.filename
-    file_data = file.read()
+    file_data = file.stream
 
     # Save the photo as a Document linked to the Listing (later)
     new_document = Document(
@@ -107,21 +154,74 @@ def upload_photo():
         uploaded_by=user.id,
         document_type='Photo',
         file_name=file_name,
-        file_data=file_data
+        file_data=file_data,
+        mime_type=file.mimetype
     )
     db.session.add(new_document)
-    db.session.commit()
+    schedule_derivatives(new_document)  # Thumbnails are rendered in the background after the commit
 
     # Update task progress
-    task_progress['provide_photo_for_listing'] = True
-    user.task_progress['Seller'] = task_progress
-    flag_modified(user, 'task_progress')
-    db.session.commit()
+    user.complete_tasks('provide_photo_for_listing')
 
     return jsonify({'message': 'Photo uploaded successfully', 'document_id': new_document.id}), 201
 
+@listings_bp.route('/upload_photos', methods=['POST'])
+#@login_required
+@idempotent
+def upload_photos():
+    """
+    Upload many photos for the listing in one multipart request (repeated `photos` fields).
+    All photos are saved, and the task marked complete, in a single transaction.
+    """
+    files = [file for file in request.files.getlist('photos') if file.filename]
+    user_id = request.form.get('user_id')
+
+    if not (files and user_id):
+        return jsonify({'error': 'Photos and user_id are required'}), 400
+    max_files = current_app.config['PHOTO_BATCH_MAX_FILES']
+    if len(files) > max_files:
+        return jsonify({'error': f'At most {max_files} photos can be uploaded at once'}), 400
+
+    # Fetch the Seller
+    user = User.query.get(user_id)
+    if not user or user.role.role_name != 'Seller':
+        return jsonify({'error': 'Invalid user or role'}), 403
+
+    # Ensure the previous task (prepare_home_for_listing) is completed
+    error = check_transition(user, 'provide_photo_for_listing', message='You must prepare the home before uploading a photo')
+    if error:
+        return error
+
+    # Each photo was spooled while the request was parsed; storage copies it into place
+    rows = [
+        {
+            'listing_id': None,  # No listing yet
+            'uploaded_by': user.id,
+            'document_type': 'Photo',
+            'file_name': file.filename,
+            **store_file(file.stream, file.mimetype, file.filename)
+        }
+        for file in files
+    ]
+    # One multi-row INSERT ... RETURNING for all the photos
+    document_ids = db.session.scalars(
+        insert(Document).returning(Document.id, sort_by_parameter_order=True), rows
+    ).all()
+
+    for document_id, row in zip(document_ids, rows):
+        queue_derivatives(document_id, row['content_hash'], row['codec'], row['file_data'])
+
+    # Update task progress
+    user.complete_tasks('provide_photo_for_listing')
+
+    return jsonify({
+        'message': f'{len(document_ids)} photos uploaded successfully',
+        'document_ids': document_ids
+    }), 201
+
 @listings_bp.route('/create_listing', methods=['POST'])
 #@login_required
+@idempotent
 def create_listing():
     """
     Finalize the listing and enter it into the FSH website.
@@ -141,9 +241,9 @@ def create_listing():
         return jsonify({'error': 'Invalid user or role'}), 403
 
     # Ensure the previous task (photo upload) is completed
-    task_progress = user.task_progress.get('Seller', {})
-    if not task_progress.get('provide_photo_for_listing', False):
-        return jsonify({'error': 'You must upload a photo before creating the listing'}), 400
+    error = check_transition(user, 'enter_sale_listing_in_fsh', message='You must upload a photo before creating the listing')
+    if error:
+        return error
 
     # Create the listing
     new_listing = Listing(
@@ -155,30 +255,75 @@ def create_listing():
         status='Pending Approval'
     )
     db.session.add(new_listing)
-    db.session.commit()
+    db.session.flush()  # Assigns the listing id
 
     # Associate documents with the newly created listing
-    documents = Document.query.filter_by(uploaded_by=user.id, listing_id=None).all()
+    documents = Document.query.filter_by(uploaded_by=user.id, listing_id=None, parent_id=None).all()  # Variants follow their original
     for doc in documents:
         doc.listing_id = new_listing.id
-        db.session.add(doc)  # Mark the document as updated
-    db.session.commit()  # Commit changes to both listing and documents
 
     # Update task progress
-    task_progress['enter_sale_listing_in_fsh'] = True
-    user.task_progress['Seller'] = task_progress
-    flag_modified(user, 'task_progress')
-    db.session.commit()
+    user.complete_tasks('enter_sale_listing_in_fsh')
+    invalidate_listing(new_listing.id)
 
     return jsonify({'message': 'Listing created and entered into FSH system', 'listing_id': new_listing.id}), 201
 
+@listings_bp.route('/bulk_import', methods=['POST'])
+#@login_required
+def bulk_import():
+    """
+    FSH agent imports many listings at once from a CSV or NDJSON file.
+    Columns: seller_id, title, price, description, address, and optionally status, bedrooms, bathrooms,
+    squarefootage. A seller_id form field applies to rows without one. Valid rows are imported and every
+    rejected row is reported with its line number.
+    """
+    file = request.files.get('file')
+    user_id = request.form.get('user_id')  # FSH agent's ID
+
+    if not (file and user_id):
+        return jsonify({'error': 'file and user_id are required'}), 400
+
+    # Fetch the FSH agent
+    user = User.query.get(user_id)
+    if not user or user.role.role_name != 'FSH':
+        return jsonify({'error': 'Only FSH agents can import listings'}), 403
+
+    file_format = detect_format(file.filename, request.form.get('format'))
+    if file_format not in IMPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(IMPORT_FORMATS)}"}), 400
+
+    result = import_listings(file.stream, file_format, default_seller_id=request.form.get('seller_id'))
+    if result['imported']:
+        invalidate_all_listings()
+
+    return jsonify(result), 201 if result['imported'] else 200
+
+@listings_bp.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(IMPORT_FORMATS), help='Defaults to the file extension.')
+@click.option('--seller-id', type=int, help='Seller for rows without a seller_id column.')
+def import_listings_command(path, file_format, seller_id):
+    """Bulk import listings from a CSV or NDJSON file: flask listings import PATH"""
+    with open(path, 'rb') as stream:
+        result = import_listings(stream, detect_format(path, file_format), default_seller_id=seller_id)
+    if result['imported']:
+        invalidate_all_listings()
+    db.session.commit()
+
+    for error in result['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Imported {result['imported']} of {result['total']} rows ({result['error_count']} rejected)")
+
 @listings_bp.route('/get_all_listings', methods=['GET'])
 #@login_required
+@query_budget(4)
 def get_all_listings():
     """
     Fetch all listings for Buyers and FSH agents.
     - Buyers can only see listings with 'Approved' status.
     - FSH agents can see all listings.
+    Results are paged by (created_at, id): pass ?limit= and the X-Next-Cursor value as ?cursor= for the next page.
+    Pass ?stream=1 to receive every matching listing as one incrementally streamed JSON array instead.
     """
     user_id = request.args.get('user_id')
     # return  jsonify(user_id)
@@ -193,33 +338,183 @@ def get_all_listings():
 
     # If the user is a Buyer, filter listings with 'Approved' status
     if user.role.role_name == 'Buyer':
-        listings = Listing.query.filter_by(status='Approved').all()
+        query = Listing.query.filter_by(status='Approved')
     else:
         # If the user is FSH agent, fetch all listings (no filter by status)
-        listings = Listing.query.all()
+        query = Listing.query
+
+    # Load the documents of the whole page in one extra query instead of one per listing
+    query = query.options(*LISTING_LOADERS)
+
+    # Stream the whole feed when asked, so memory stays flat however many listings and photos exist
+    if request.args.get('stream') == '1':
+        return Response(stream_with_context(stream_listings(query)), mimetype='application/json')
+
+    def load_page():
+        listings, next_cursor = keyset_paginate(query, (Listing.created_at, Listing.id))
+        # Prepare response data
+        return [format_listing(listing) for listing in listings], next_cursor
+
+    # Every Buyer sees the same approved feed, so its pages are shared through the cache
+    if user.role.role_name == 'Buyer':
+        listings_data, next_cursor = feed_cache.get_or_load((request.args.get('cursor'), page_limit()), load_page)
+    else:
+        listings_data, next_cursor = load_page()
+
+    return with_next_cursor(jsonify(listings_data), next_cursor), 200
+
+# Range filters accepted by /search as ?min_<name>= and ?max_<name>=
+SEARCH_RANGE_FILTERS = {
+    'price': (Listing.price, Decimal),
+    'bedrooms': (Listing.bedrooms, int),
+    'bathrooms': (Listing.bathrooms, int),
+    'squarefootage': (Listing.squarefootage, int)
+}
+
+# Sort options accepted by /search as ?sort=, mapped to (keyset columns, descending)
+SEARCH_SORTS = {
+    'newest': ((Listing.created_at, Listing.id), True),
+    'oldest': ((Listing.created_at, Listing.id), False),
+    'price_asc': ((Listing.price, Listing.id), False),
+    'price_desc': ((Listing.price, Listing.id), True)
+}
+
+@listings_bp.route('/search', methods=['GET'])
+#@login_required
+@query_budget(4)
+def search_listings():
+    """
+    Search listings by price, bedrooms, bathrooms and square footage ranges, with sorting.
+    - Buyers only search 'Approved' listings; FSH agents may pass ?status= to search any status.
+    - Filters: ?min_price=&max_price=, and likewise for bedrooms, bathrooms and squarefootage.
+    - Sort with ?sort= one of newest (default), oldest, price_asc, price_desc.
+    Results are paged like get_all_listings.
+    """
+    user_id = request.args.get('user_id')
+
+    # Fetch the user
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    # Ensure the user is either a Buyer or FSH agent
+    if user.role.role_name not in ['Buyer', 'FSH']:
+        return jsonify({'error': 'Only Buyers or FSH agents can search listings'}), 403
+
+    sort = request.args.get('sort', 'newest')
+    if sort not in SEARCH_SORTS:
+        return jsonify({'error': f"Invalid sort. Use one of: {', '.join(SEARCH_SORTS)}"}), 400
+
+    # Buyers only ever see approved listings; this keeps their searches on the partial indexes
+    if user.role.role_name == 'Buyer':
+        status = 'Approved'
+    else:
+        status = request.args.get('status')
+
+    query = Listing.query
+    if status:
+        query = query.filter(Listing.status == status)
+
+    for name, (column, cast) in SEARCH_RANGE_FILTERS.items():
+        for bound in ('min', 'max'):
+            raw_value = request.args.get(f'{bound}_{name}')
+            if raw_value is None:
+                continue
+            try:
+                value = cast(raw_value)
+            except (ValueError, ArithmeticError):
+                return jsonify({'error': f'{bound}_{name} must be a number'}), 400
+            if isinstance(value, Decimal) and not value.is_finite():  # Decimal() also parses Infinity and NaN
+                return jsonify({'error': f'{bound}_{name} must be a finite number'}), 400
+            query = query.filter(column >= value if bound == 'min' else column <= value)
+
+    query = query.options(*LISTING_LOADERS)
+
+    order_by, descending = SEARCH_SORTS[sort]
+    listings, next_cursor = keyset_paginate(query, order_by, descending=descending)
 
     # Prepare response data
-    listings_data = [
-        {
-            'id': listing.id,
-            'title': listing.title,
-            'price': listing.price,
-            'description': listing.description,
-            'address': listing.address,
-            'status': listing.status,
-            'created_at': listing.created_at,
-            'documents': [format_document(doc) for doc in listing.documents],
-            'bedrooms': listing.bedrooms,
-            'bathrooms': listing.bathrooms,
-            'squarefootage': listing.squarefootage
-        }
-        for listing in listings
-    ]
+    listings_data = [format_listing(listing) for listing in listings]
+
+    return with_next_cursor(jsonify(listings_data), next_cursor), 200
+
+@listings_bp.route('/text_search', methods=['GET'])
+#@login_required
+@query_budget(4)
+def text_search_listings():
+    """
+    Ranked full-text search over listing titles and descriptions.
+    - ?q= accepts web-search syntax: quoted phrases, OR, and -excluded words.
+    - Buyers only see 'Approved' listings; FSH agents see all listings.
+    Title matches rank above description matches. Returns at most ?limit= listings, best match first.
+    """
+    user_id = request.args.get('user_id')
+    search_text = (request.args.get('q') or '').strip()
+
+    if not search_text:
+        return jsonify({'error': 'q is required'}), 400
+
+    # Fetch the user
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    # Ensure the user is either a Buyer or FSH agent
+    if user.role.role_name not in ['Buyer', 'FSH']:
+        return jsonify({'error': 'Only Buyers or FSH agents can search listings'}), 403
+
+    ts_query = func.websearch_to_tsquery('english', search_text)
+    rank = func.ts_rank_cd(Listing.search_vector, ts_query)
+
+    # The @@ match is served by the GIN index on search_vector; only matching rows are ranked
+    query = Listing.query.filter(Listing.search_vector.op('@@')(ts_query))
+    if user.role.role_name == 'Buyer':
+        query = query.filter(Listing.status == 'Approved')
+
+    listings = query.options(*LISTING_LOADERS) \
+        .order_by(rank.desc(), Listing.id) \
+        .limit(page_limit()) \
+        .all()
+
+    # Prepare response data
+    listings_data = [format_listing(listing) for listing in listings]
 
     return jsonify(listings_data), 200
 
+@listings_bp.route('/autocomplete_address', methods=['GET'])
+#@login_required
+@query_budget(1)
+def autocomplete_address():
+    """
+    Suggest addresses of approved listings matching the typed text, cheap enough to call per keystroke.
+    Addresses starting with ?q= come first, then other addresses containing it, most similar first.
+    """
+    search_text = (request.args.get('q') or '').strip()
+
+    # Trigram lookups need at least three characters to narrow the index scan
+    if len(search_text) < 3:
+        return jsonify({'suggestions': []}), 200
+
+    limit = page_limit(default=10)
+
+    # Match with the trigram index, then put prefix matches first
+    rows = db.session.query(Listing.id, Listing.address) \
+        .filter(Listing.status == 'Approved', Listing.address.icontains(search_text, autoescape=True)) \
+        .order_by(
+            Listing.address.istartswith(search_text, autoescape=True).desc(),
+            func.similarity(Listing.address, search_text).desc(),
+            Listing.id
+        ) \
+        .limit(limit) \
+        .all()
+
+    suggestions = [{'listing_id': row.id, 'address': row.address} for row in rows]
+
+    return jsonify({'suggestions': suggestions}), 200
+
 @listings_bp.route('/get_my_listings', methods=['GET'])
 #@login_required
+@query_budget(4)
 def get_my_listings():
     """
     Fetch listings for the Seller. Only shows listings posted by that Seller.
@@ -236,43 +531,55 @@ def get_my_listings():
         return jsonify({'error': 'Only Sellers can view their own listings'}), 403
 
     # Fetch listings where the seller_id matches the user's ID
-    listings = Listing.query.filter_by(seller_id=user_id).all()
+    listings, next_cursor = keyset_paginate(
+        Listing.query.filter_by(seller_id=user.id).options(*LISTING_LOADERS),
+        (Listing.created_at, Listing.id)
+    )
 
     # Prepare response data
-    listings_data = [
-        {
-            'id': listing.id,
-            'title': listing.title,
-            'price': listing.price,
-            'description': listing.description,
-            'address': listing.address,
-            'status': listing.status,
-            'created_at': listing.created_at,
-            'documents': [format_document(doc) for doc in listing.documents]
-        }
-        for listing in listings
-    ]
+    listings_data = [format_listing(listing) for listing in listings]
 
-    return jsonify(listings_data), 200
+    return with_next_cursor(jsonify(listings_data), next_cursor), 200
 
 @listings_bp.route('/get_listing_by_id', methods=['GET'])
 #@login_required
+@query_budget(3)
 def get_listing_by_id():
     """
     Fetch details of a specific listing by listing_id.
     """
-    listing_id = request.args.get('listing_id')
+    listing_id = request.args.get('listing_id', type=int)
 
     if not listing_id:
         return jsonify({'error': 'listing_id is required'}), 400
 
-    # Fetch the listing by ID
-    listing = Listing.query.get(listing_id)
-    if not listing:
+    # Serve from the cache; concurrent misses for the same listing share one database load
+    listing_data = listing_cache.get_or_load(listing_id, lambda: load_listing_data(listing_id))
+    if not listing_data:
         return jsonify({'error': 'Listing not found'}), 404
 
+    # Clients polling an unchanged listing get a 304 without the payload being serialized again.
+    # The URL epoch is part of the tag so a 304 never keeps a client on expired document URLs.
+    etag = f"listing-{listing_id}-v{listing_data['version']}-o{listing_data['offers_version']}-u{url_epoch()}"
+    response = not_modified(etag)
+    if response:
+        return response
+
+    response = jsonify(listing_data)
+    response.set_etag(etag)
+    return response, 200
+
+def load_listing_data(listing_id):
+    """
+    Load and serialize a single listing, or return None if it does not exist.
+    """
+    # Fetch the listing by ID together with its documents
+    listing = db.session.get(Listing, listing_id, options=LISTING_LOADERS)
+    if not listing:
+        return None
+
     # Prepare response data
-    listing_data = {
+    return {
         'id': listing.id,
         'title': listing.title,
         'price': listing.price,
@@ -280,16 +587,19 @@ def get_listing_by_id():
         'address': listing.address,
         'status': listing.status,
         'created_at': listing.created_at,
-        'documents': [format_document(doc) for doc in listing.documents]
+        'documents': [format_document(doc) for doc in listing.documents],
+        'offer_stats': format_offer_stats(listing.offer_stats),
+        'version': listing.version_id,
+        'offers_version': listing.offers_version
     }
 
-    return jsonify(listing_data), 200
-
 @listings_bp.route('/update_listing', methods=['PUT'])
 #@login_required
 def update_listing():
     """
     Allow the Seller to update their own listing (title, price, description, address) or just documents.
+    Send the listing's `version` (or an If-Match header with its ETag) to make sure nobody changed it in the
+    meantime; a conflicting write is rejected with 409 instead of silently overwriting the other one.
     """
     data = request.get_json()
     listing_id = data.get('listing_id')  # Listing to update
@@ -299,11 +609,19 @@ def update_listing():
     description = data.get('description')
     address = data.get('address')
     document_updates = data.get('documents')  # List of documents to update or add
+    expected_version = data.get('version')  # Version the client last read, for optimistic locking
 
     # Validate required fields: listing_id and user_id
     if not listing_id or not user_id:
         return jsonify({'error': 'listing_id and user_id are required'}), 400
 
+    # Clients may send the version as a number or a string; compare it as the integer it is
+    if expected_version is not None:
+        try:
+            expected_version = int(str(expected_version))  # Via str so 2.7 and true are refused, not truncated
+        except ValueError:
+            return jsonify({'error': 'version must be an integer'}), 400
+
     # Fetch the listing and the Seller
     listing = Listing.query.get(listing_id)
     user = User.query.get(user_id)
@@ -318,6 +636,14 @@ def update_listing():
     if listing.seller_id != user.id:
         return jsonify({'error': 'You can only update your own listings'}), 403
 
+    # Fail fast if the client edited an outdated copy of the listing. Only the version part of the
+    # ETag matters here, not the offers version and document URL epoch it also carries.
+    etag = f'listing-{listing.id}-v{listing.version_id}'
+    if_match_stale = request.if_match and not request.if_match.star_tag and \
+        not any(tag == etag or tag.startswith(etag + '-') for tag in request.if_match.as_set())
+    if (expected_version is not None and expected_version != listing.version_id) or if_match_stale:
+        return jsonify({'error': 'Listing was modified by someone else', 'version': listing.version_id}), 409
+
     # Update the listing if fields are provided
     if title:
         listing.title = title
@@ -346,7 +672,7 @@ def update_listing():
                 file = request.files.get(f"document_{document.get('document_id')}")
                 if file:
                     file_name = file.filename
-                    file_data = file.read()  # Read the file as binary
+                    file_data = file.stream  # Spooled upload, streamed into storage
 
                     # If updating an existing document
                     if document.get('action') == 'update' and document.get('document_id'):
@@ -354,8 +680,10 @@ def update_listing():
                         document_to_update = Document.query.get(doc_id)
                         if document_to_update:
                             document_to_update.file_name = file_name
-                            document_to_update.file_data = file_data
-                            db.session.commit()
+                            document_to_update.set_content(file_data, file.mimetype)
+                            if document_to_update.document_type == 'Photo':
+                                document_to_update.variants.clear()  # Re-render from the new image
+                                schedule_derivatives(document_to_update)
                         else:
                             return jsonify({'error': f'Document with ID {doc_id} not found'}), 404
                     # If it's a new document
@@ -365,17 +693,29 @@ def update_listing():
                             uploaded_by=user.id,
                             document_type=document.get('document_type'),
                             file_name=file_name,
-                            file_data=file_data
+                            file_data=file_data,
+                            mime_type=file.mimetype
                         )
                         db.session.add(new_document)
+                        if new_document.document_type == 'Photo':
+                            schedule_derivatives(new_document)
+
+        listing.touch()  # Documents are part of the listing payload
 
-        db.session.commit()
+    invalidate_listing(listing.id)
+    try:
+        db.session.flush()  # Writes now, so a conflict is answered here; the request commits afterwards
+    except StaleDataError:
+        # Another request updated the listing between our read and this write
+        db.session.rollback()
+        return jsonify({'error': 'Listing was modified by someone else'}), 409
 
-    return jsonify({'message': 'Listing and documents updated successfully', 'listing_id': listing.id}), 200
+    return jsonify({'message': 'Listing and documents updated successfully', 'listing_id': listing.id, 'version': listing.version_id}), 200
 
 
 @listings_bp.route('/get_pending_listings', methods=['GET'])
 #@login_required
+@query_budget(4)
 def get_pending_listings():
     """
     Fetch all listings with 'Pending Approval' status for FSH agent review.
@@ -392,24 +732,15 @@ def get_pending_listings():
         return jsonify({'error': 'Only FSH agents can view pending listings'}), 403
 
     # Fetch all pending listings (no filtering by seller_id)
-    pending_listings = Listing.query.filter_by(status='Pending Approval').all()
+    pending_listings, next_cursor = keyset_paginate(
+        Listing.query.filter_by(status='Pending Approval').options(*LISTING_LOADERS),
+        (Listing.created_at, Listing.id)
+    )
 
-    # Prepare response data
-    listings_data = [
-        {
-            'id': listing.id,
-            'title': listing.title,
-            'price': listing.price,
-            'description': listing.description,
-            'address': listing.address,
-            'seller_id': listing.seller_id,
-            'created_at': listing.created_at,
-            'documents': [format_document(doc) for doc in listing.documents]
-        }
-        for listing in pending_listings
-    ]
+    # Prepare response data; reviewers also need to know whose listing it is
+    listings_data = [dict(format_listing(listing), seller_id=listing.seller_id) for listing in pending_listings]
 
-    return jsonify(listings_data), 200
+    return with_next_cursor(jsonify(listings_data), next_cursor), 200
 
 @listings_bp.route('/approve_listing', methods=['POST'])
 #@login_required
@@ -439,16 +770,20 @@ def approve_listing():
     if listing.status != 'Pending Approval':
         return jsonify({'error': 'Listing is not pending approval'}), 400
 
+    # First task of the FSH sequence, but checked like every other transition
+    error = check_transition(fsh_agent, 'approve_listing_in_fsh')
+    if error:
+        return error
+
     # Approve the listing
     listing.status = 'Approved'
 
     # Update FSH agent's task progress
-    task_progress = fsh_agent.task_progress.get('FSH', {})
-    task_progress['approve_listing_in_fsh'] = True
-    fsh_agent.task_progress['FSH'] = task_progress
+    fsh_agent.complete_tasks('approve_listing_in_fsh')
 
-    # Save changes to the database
-    flag_modified(fsh_agent, 'task_progress')
-    db.session.commit()
+    # Saved when the request commits
+    invalidate_listing(listing.id)
+    emit('listing_approved', [listing.seller_id, fsh_agent.id], listing_id=listing.id)
+    emit('task_completed', [fsh_agent.id], role='FSH', task_name='approve_listing_in_fsh')
 
     return jsonify({'message': 'Listing approved successfully', 'listing_id': listing.id}), 200
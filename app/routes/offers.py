@@ -1,12 +1,112 @@
 from flask import Blueprint, request, jsonify
-from app.models import db, User, Listing, Offer
-from app.utils import login_required
+from app.models import db, User, Listing, Offer, ListingOfferStats
+from app.utils import login_required, keyset_paginate, with_next_cursor, query_budget, not_modified
+from app.cache import invalidate_listing
+from app.events import emit
+from app.idempotency import idempotent
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
 
 # Create a Blueprint for offers
 offers_bp = Blueprint('offers', __name__)
 
+def bump_offers_version(listing_id):
+    """
+    Record that the set of offers on a listing changed, so get_offers_for_listing ETags change.
+    Issued as a plain UPDATE so it does not conflict with the listing's own row version.
+    """
+    db.session.execute(
+        update(Listing).where(Listing.id == listing_id).values(offers_version=Listing.offers_version + 1),
+        execution_options={'synchronize_session': False}
+    )
+
+def format_offer_stats(stats):
+    """
+    Format a listing's offer summary; listings without offers have no stats row yet.
+    """
+    return {
+        'offer_count': stats.offer_count if stats else 0,
+        'pending_count': stats.pending_count if stats else 0,
+        'highest_offer': stats.highest_offer if stats else None,
+        'lowest_offer': stats.lowest_offer if stats else None,
+        'latest_offer': {
+            'offer_id': stats.latest_offer_id,
+            'offer_price': stats.latest_offer_price,
+            'created_at': stats.latest_offer_at
+        } if stats and stats.latest_offer_id else None
+    }
+
+def record_offer_submitted(offer):
+    """
+    Fold a new offer into its listing's stats with one upsert. The row lock it takes serializes concurrent
+    offers on the same listing, so the counts stay exact.
+    """
+    stats = insert(ListingOfferStats).values(
+        listing_id=offer.listing_id,
+        offer_count=1,
+        pending_count=1,
+        highest_offer=offer.offer_price,
+        lowest_offer=offer.offer_price,
+        latest_offer_id=offer.id,
+        latest_offer_price=offer.offer_price,
+        latest_offer_at=offer.created_at
+    )
+    db.session.execute(stats.on_conflict_do_update(
+        index_elements=[ListingOfferStats.listing_id],
+        set_={
+            'offer_count': ListingOfferStats.offer_count + 1,
+            'pending_count': ListingOfferStats.pending_count + 1,
+            'highest_offer': func.greatest(ListingOfferStats.highest_offer, stats.excluded.highest_offer),
+            'lowest_offer': func.least(ListingOfferStats.lowest_offer, stats.excluded.lowest_offer),
+            'latest_offer_id': stats.excluded.latest_offer_id,
+            'latest_offer_price': stats.excluded.latest_offer_price,
+            'latest_offer_at': stats.excluded.latest_offer_at
+        }
+    ))
+
+def record_offers_answered(listing_id, pending_count=None):
+    """
+    Update a listing's pending count after a response: one fewer pending offer, or `pending_count` outright.
+    """
+    db.session.execute(
+        update(ListingOfferStats).where(ListingOfferStats.listing_id == listing_id).values(
+            pending_count=ListingOfferStats.pending_count - 1 if pending_count is None else pending_count
+        ),
+        execution_options={'synchronize_session': False}
+    )
+
+@offers_bp.route('/get_offer_stats', methods=['GET'])
+# @login_required
+@query_budget(1)
+def get_offer_stats():
+    """
+    Fetch the offer count, pending count, highest, lowest and latest offer of a listing.
+    """
+    listing_id = request.args.get('listing_id', type=int)
+    if not listing_id:
+        return jsonify({'error': 'listing_id is required'}), 400
+
+    # One primary-key lookup; the listing is joined only to tell "no offers yet" from "no such listing"
+    row = db.session.execute(
+        db.select(Listing.offers_version, ListingOfferStats)
+        .outerjoin(ListingOfferStats, ListingOfferStats.listing_id == Listing.id)
+        .where(Listing.id == listing_id)
+    ).first()
+    if row is None:
+        return jsonify({'error': 'Listing not found'}), 404
+
+    etag = f'offer-stats-{listing_id}-v{row.offers_version}'
+    response = not_modified(etag)
+    if response:
+        return response
+
+    response = jsonify({'listing_id': listing_id, **format_offer_stats(row.ListingOfferStats)})
+    response.set_etag(etag)
+    return response, 200
+
 @offers_bp.route('/get_offers_for_listing', methods=['GET'])
 # @login_required
+@query_budget(3)
 def get_offers_for_listing():
     """
     Fetch all offers for a seller's listing.
@@ -24,8 +124,14 @@ def get_offers_for_listing():
     if not listing or listing.seller_id != seller.id:
         return jsonify({'error': 'Listing not found or you are not the seller of this listing'}), 404
 
-    # Fetch all offers for the listing
-    offers = Offer.query.filter_by(listing_id=listing_id).all()
+    # Pollers whose copy of the offer set is current get a 304 without the offers being queried
+    etag = f'offers-{listing.id}-v{listing.offers_version}'
+    response = not_modified(etag)
+    if response:
+        return response
+
+    # Fetch one page of offers for the listing
+    offers, next_cursor = keyset_paginate(Offer.query.filter_by(listing_id=listing.id), (Offer.created_at, Offer.id))
 
     # Prepare response data
     offers_data = [
@@ -40,10 +146,13 @@ def get_offers_for_listing():
         for offer in offers
     ]
 
-    return jsonify({'offers': offers_data}), 200
+    response = with_next_cursor(jsonify({'offers': offers_data}), next_cursor)
+    response.set_etag(etag)
+    return response, 200
 
 @offers_bp.route('/get_my_offers', methods=['GET'])
 # @login_required
+@query_budget(2)
 def get_my_offers():
     """
     Fetch all offers made by a specific buyer.
@@ -55,8 +164,8 @@ def get_my_offers():
     if not buyer or buyer.role.role_name != 'Buyer':
         return jsonify({'error': 'Invalid user or role'}), 403
 
-    # Fetch all offers made by the buyer
-    offers = Offer.query.filter_by(buyer_id=buyer.id).all()
+    # Fetch one page of offers made by the buyer
+    offers, next_cursor = keyset_paginate(Offer.query.filter_by(buyer_id=buyer.id), (Offer.created_at, Offer.id))
 
     # Prepare response data
     offers_data = [
@@ -71,10 +180,11 @@ def get_my_offers():
         for offer in offers
     ]
 
-    return jsonify({'offers': offers_data}), 200
+    return with_next_cursor(jsonify({'offers': offers_data}), next_cursor), 200
 
 @offers_bp.route('/submit_offer', methods=['POST'])
 # @login_required
+@idempotent
 def submit_offer():
     """
     Buyer submits an offer for a listing.
@@ -113,7 +223,11 @@ def submit_offer():
     )
     
     db.session.add(new_offer)
-    db.session.commit()
+    bump_offers_version(listing.id)
+    db.session.flush()  # Assigns the offer id for the stats and the event
+    record_offer_submitted(new_offer)
+    invalidate_listing(listing.id)  # Listing payloads include the offer stats
+    emit('offer_submitted', [listing.seller_id, buyer.id], offer_id=new_offer.id, listing_id=listing.id)
 
     return jsonify({'message': 'Offer submitted successfully', 'offer_id': new_offer.id}), 201
 
@@ -135,7 +249,7 @@ def respond_offer():
 
     # Fetch the seller and offer
     seller = User.query.get(user_id)
-    offer = Offer.query.get(offer_id)
+    offer = db.session.get(Offer, offer_id)
 
     if not seller or seller.role.role_name != 'Seller':
         return jsonify({'error': 'Invalid seller or user role'}), 403
@@ -143,12 +257,19 @@ def respond_offer():
     if not offer:
         return jsonify({'error': 'Offer not found'}), 404
 
-    listing = offer.listing
+    # Lock the listing row (SELECT ... FOR UPDATE) until commit: concurrent responses on the same listing
+    # queue up here, and each one sees the status the previous one committed
+    listing = db.session.get(Listing, offer.listing_id, with_for_update=True, populate_existing=True)
+    # Read the offer again under the lock: a response that committed while this one waited may have answered it
+    offer = db.session.get(Offer, offer.id, with_for_update=True, populate_existing=True)
 
     # Ensure the seller owns the listing
     if listing.seller_id != seller.id:
         return jsonify({'error': 'You can only respond to offers for your own listings'}), 403
 
+    if listing.status == 'Closed':
+        return jsonify({'error': 'This listing is already closed', 'listing_status': listing.status}), 409
+
     # Handle accepting or rejecting the offer
     if action == 'accept':
         # Update the accepted offer status
@@ -156,14 +277,23 @@ def respond_offer():
 
         # Update the listing status to "Closed"
         listing.status = 'Closed'
+        listing.offers_version += 1  # Goes out in the same UPDATE as the status
+
+        # Set all other offers for this listing to inactive in one statement, however many there are
+        outbid_buyer_ids = db.session.scalars(
+            update(Offer).where(Offer.listing_id == listing.id, Offer.id != offer.id).values(status='Inactive')
+            .returning(Offer.buyer_id),
+            execution_options={'synchronize_session': False}
+        ).all()
+
+        record_offers_answered(listing.id, pending_count=0)  # Every other offer is now inactive
 
-        # Set all other offers for this listing to inactive/rejected
-        other_offers = Offer.query.filter(Offer.listing_id == listing.id, Offer.id != offer.id).all()
-        for other_offer in other_offers:
-            other_offer.status = 'Inactive'  # Mark other offers as inactive
+        emit('offer_accepted', [offer.buyer_id, seller.id], offer_id=offer.id, listing_id=listing.id)
+        emit('offer_inactive', outbid_buyer_ids, listing_id=listing.id)
 
-        db.session.commit()
+        invalidate_listing(listing.id)  # The listing is now closed
 
+        # The listing row stays locked until the request's transaction commits
         return jsonify({
             'message': 'Offer accepted successfully',
             'offer_id': offer.id,
@@ -172,8 +302,12 @@ def respond_offer():
 
     elif action == 'reject':
         # Reject the offer
+        if offer.status == 'Pending':
+            record_offers_answered(listing.id)
         offer.status = 'Rejected'
-        db.session.commit()
+        bump_offers_version(listing.id)
+        invalidate_listing(listing.id)  # Listing payloads include the offer stats
+        emit('offer_rejected', [offer.buyer_id, seller.id], offer_id=offer.id, listing_id=listing.id)
 
         return jsonify({'message': 'Offer rejected successfully', 'offer_id': offer.id}), 200
 
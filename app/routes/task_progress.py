@@ -1,7 +1,14 @@
+from datetime import datetime
 from flask import Blueprint, request, jsonify
-from app.models import db, User
+import click
+from app.models import db, User, Role
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.exc import SQLAlchemyError
-from app.routes.tasks import TASK_SEQUENCES  # Import task sequences for role-based tasks
+from app.routes.tasks import TASK_GRAPH, check_transition, progress_from_bits, bits_from_progress  # Role-based task sequences as bitmasks
+from app.utils import not_modified
+from app.cache import cohort_cache
+from app.events import emit
 
 task_progress_bp = Blueprint('task_progress', __name__)
 
@@ -14,7 +21,29 @@ def complete_task():
     # Ensure the user ID and task_name are provided
     if not user_id or not task_name:
         return jsonify({'error': 'user_id and task_name are required'}), 400
+    if not isinstance(task_name, str):
+        return jsonify({'error': 'task_name must be a string'}), 400
 
+    return _complete(user_id, [task_name], 'Task completed successfully')
+
+@task_progress_bp.route('/complete_tasks', methods=['POST'])
+def complete_tasks():
+    """
+    Mark several tasks completed at once, e.g. {"user_id": 1, "task_names": ["a", "b"]}.
+    All of them are set by one UPDATE, so either every task is recorded or none is.
+    """
+    data = request.get_json()
+    user_id = data.get('user_id')
+    task_names = data.get('task_names')
+
+    if not user_id or not task_names or not isinstance(task_names, list):
+        return jsonify({'error': 'user_id and a list of task_names are required'}), 400
+    if not all(isinstance(task_name, str) for task_name in task_names):
+        return jsonify({'error': 'task_names must all be strings'}), 400
+
+    return _complete(user_id, task_names, f'{len(set(task_names))} tasks completed successfully')
+
+def _complete(user_id, task_names, message):
     # Fetch the user by ID
     user = User.query.get(user_id)
     if not user:
@@ -23,25 +52,22 @@ def complete_task():
     # Get the user's role
     user_role = user.role.role_name
 
-    # Check if the task exists for the user's role
-    if user_role not in TASK_SEQUENCES or task_name not in TASK_SEQUENCES[user_role]:
-        return jsonify({'error': f"Task '{task_name}' not found for role '{user_role}'"}), 400
+    # Check that every task exists for the user's role and that its prerequisites are done
+    error = check_transition(user, *task_names)
+    if error:
+        return error
 
-    # Initialize task progress for the role if not already set
-    if user_role not in user.task_progress:
-        user.task_progress[user_role] = {task: False for task in TASK_SEQUENCES[user_role]}
-
-    # Mark the task as completed (set the task progress to True)
-    user.task_progress[user_role][task_name] = True
-
-    # Commit the changes to the database
+    # Set the bits in the database rather than rewriting the whole progress document
     try:
-        db.session.commit()
-        return jsonify({'message': 'Task completed successfully'}), 200
+        progress_bits = user.complete_tasks(*task_names)
+        for task_name in dict.fromkeys(task_names):
+            emit('task_completed', [user.id], role=user_role, task_name=task_name)
     except SQLAlchemyError as e:
         db.session.rollback()  # Rollback in case of error
         return jsonify({'error': str(e)}), 500
 
+    return jsonify({'message': message, 'task_progress': progress_from_bits(user_role, progress_bits)}), 200
+
 @task_progress_bp.route('/get_task_progress', methods=['GET'])
 def get_task_progress():
     user_id = request.args.get('user_id')  # Get user_id from the query parameter
@@ -49,20 +75,133 @@ def get_task_progress():
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
 
-    # Fetch the user by ID
-    user = User.query.get(user_id)
-    if not user:
+    # One indexed lookup: the version decides the ETag, and the bitmask is all the progress there is
+    row = db.session.execute(
+        db.select(User.version_id, User.task_progress_bits, Role.role_name)
+        .outerjoin(Role, User.role_id == Role.id).where(User.id == user_id)
+    ).first()
+    if row is None:
         return jsonify({'error': 'User not found'}), 404
 
-    # Get the user's role
-    user_role = user.role.role_name
-
-    # Fetch task progress for the user's role
-    task_progress = user.task_progress.get(user_role, {})
+    etag = f'task-progress-{user_id}-v{row.version_id}'
+    response = not_modified(etag)
+    if response:
+        return response
 
     # Return the user's task progress for their role
-    return jsonify({
-        'user_id': user.id,
-        'role': user_role,
-        'task_progress': task_progress
-    }), 200
+    response = jsonify({
+        'user_id': int(user_id),
+        'role': row.role_name,
+        'task_progress': progress_from_bits(row.role_name, row.task_progress_bits)
+    })
+    response.set_etag(etag)
+    return response, 200
+
+@task_progress_bp.route('/get_next_tasks', methods=['GET'])
+def get_next_tasks():
+    """
+    Tasks the user can do now: not yet completed, with every prerequisite done.
+    Spares clients from fetching the whole progress dict and working this out themselves.
+    """
+    user_id = request.args.get('user_id')
+
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    row = db.session.execute(
+        db.select(User.version_id, User.task_progress_bits, Role.role_name)
+        .outerjoin(Role, User.role_id == Role.id).where(User.id == user_id)
+    ).first()
+    if row is None:
+        return jsonify({'error': 'User not found'}), 404
+
+    etag = f'next-tasks-{user_id}-v{row.version_id}'
+    response = not_modified(etag)
+    if response:
+        return response
+
+    sequence = TASK_GRAPH.get(row.role_name)
+    next_tasks = sequence.next_tasks(row.task_progress_bits) if sequence else []
+    response = jsonify({
+        'user_id': int(user_id),
+        'role': row.role_name,
+        'next_tasks': next_tasks,
+        'completed_count': bin(row.task_progress_bits).count('1'),
+        'total_count': len(sequence.tasks) if sequence else 0
+    })
+    response.set_etag(etag)
+    return response, 200
+
+@task_progress_bp.route('/get_cohort_stats', methods=['GET'])
+def get_cohort_stats():
+    """
+    For FSH staff: per role, how many users completed each task and how many are stuck at each step.
+    Pass role to limit it to one role, and fresh=true to recount instead of using the cached snapshot.
+    """
+    user_id = request.args.get('user_id')
+    role = request.args.get('role')
+
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    user = User.query.get(user_id)
+    if not user or user.role.role_name != 'FSH':
+        return jsonify({'error': 'Only FSH agents can view cohort stats'}), 403
+    if role is not None and role not in TASK_GRAPH:
+        return jsonify({'error': f"Role '{role}' has no task sequence"}), 400
+
+    key = role or '*'
+    if request.args.get('fresh', '').lower() in ('1', 'true'):
+        cohort_cache.invalidate(key)
+    return jsonify(cohort_cache.get_or_load(key, lambda: load_cohort_stats(role))), 200
+
+def load_cohort_stats(role=None):
+    """
+    Count users per (role, progress bitmask) in one pass and derive every figure from that histogram.
+    Users who finished the same tasks share a bitmask, so the result has a few rows per role however many
+    users there are, and the GROUP BY runs as an index-only scan of idx_users_role_task_progress.
+    """
+    counts = db.select(User.role_id, User.task_progress_bits, func.count().label('users')) \
+        .group_by(User.role_id, User.task_progress_bits)
+    if role is not None:
+        counts = counts.where(User.role_id == db.select(Role.id).where(Role.role_name == role).scalar_subquery())
+    counts = counts.subquery()
+    rows = db.session.execute(
+        db.select(Role.role_name, counts.c.task_progress_bits, counts.c.users).join(counts, counts.c.role_id == Role.id)
+    ).all()
+
+    histograms = {role_name: {} for role_name in ([role] if role else TASK_GRAPH)}
+    for role_name, progress_bits, users in rows:
+        if role_name in histograms:
+            histograms[role_name][progress_bits] = users
+    return {
+        'generated_at': datetime.utcnow().isoformat() + 'Z',
+        'roles': {role_name: TASK_GRAPH[role_name].cohort(histogram) for role_name, histogram in histograms.items()}
+    }
+
+@task_progress_bp.cli.command('backfill-bits')
+@click.option('--batch-size', default=500, show_default=True, help='Users updated per transaction.')
+def backfill_bits(batch_size):
+    """Fill task_progress_bits from the legacy task_progress JSONB column (see migration 12)."""
+    converted = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(
+            'SELECT u.id, r.role_name, u.task_progress FROM users u LEFT JOIN roles r ON r.id = u.role_id '
+            'WHERE u.id > :last_id ORDER BY u.id LIMIT :limit'
+        ).columns(task_progress=JSONB), {'last_id': last_id, 'limit': batch_size}).all()
+        if not rows:
+            break
+        updates = [
+            {'user_id': user_id, 'bits': bits_from_progress(role_name, (progress or {}).get(role_name, {}))}
+            for user_id, role_name, progress in rows
+        ]
+        # OR into the existing bits so tasks completed since the deploy are kept
+        db.session.execute(text(
+            'UPDATE users SET task_progress_bits = task_progress_bits | :bits, version_id = version_id + 1 '
+            'WHERE id = :user_id'
+        ), updates)
+        db.session.commit()
+        converted += len(rows)
+        last_id = rows[-1][0]
+    click.echo(f'Backfilled task progress for {converted} users')
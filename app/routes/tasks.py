@@ -1,4 +1,6 @@
 
+from flask import jsonify
+
 #TODO: verify
 
 TASK_SEQUENCES = {
@@ -62,3 +64,125 @@ TASK_SEQUENCES = {
         'close_sale_listing'
     ]
 }
+
+# Tasks that can be done without finishing the task before them in the sequence: {role: {task: [prerequisites]}}.
+# Every task not listed here requires the one before it, so a sequence is worked through in order.
+TASK_PREREQUISITES = {}
+
+class TaskSequence:
+    """
+    One role's sequence compiled once at import: each task's bit in task_progress_bits and a mask of the bits
+    it requires. Checking a transition is then a couple of integer operations on the user's bitmask.
+    """
+
+    def __init__(self, role, tasks, prerequisites=None):
+        self.role = role
+        self.tasks = tuple(tasks)
+        self.bits = {task: 1 << index for index, task in enumerate(self.tasks)}
+        prerequisites = prerequisites or {}
+        unknown = [task for task in prerequisites if task not in self.bits] + \
+            [required for required_tasks in prerequisites.values() for required in required_tasks if required not in self.bits]
+        if unknown:
+            raise ValueError(f"Unknown {role} tasks in TASK_PREREQUISITES: {', '.join(unknown)}")
+        self.requires = {}
+        for index, task in enumerate(self.tasks):
+            required_tasks = prerequisites.get(task, self.tasks[index - 1:index])
+            self.requires[task] = self.mask(required_tasks)
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        # Kahn's algorithm over the prerequisite masks; anything left over is part of a cycle
+        done = 0
+        remaining = set(self.tasks)
+        while remaining:
+            ready = {task for task in remaining if not self.requires[task] & ~done}
+            if not ready:
+                raise ValueError(f"Circular prerequisites among {self.role} tasks: {', '.join(sorted(remaining))}")
+            done |= self.mask(ready)
+            remaining -= ready
+
+    def mask(self, task_names):
+        """Bitmask of task_names. Raises KeyError for a task the role does not have."""
+        mask = 0
+        for task_name in task_names:
+            mask |= self.bits[task_name]
+        return mask
+
+    def missing(self, task_name, progress_bits):
+        """Prerequisites of task_name not set in progress_bits, in sequence order."""
+        missing_bits = self.requires[task_name] & ~progress_bits
+        return [task for task in self.tasks if missing_bits & self.bits[task]] if missing_bits else []
+
+    def next_tasks(self, progress_bits):
+        """Tasks not yet done whose prerequisites all are."""
+        return [task for task in self.tasks
+                if not progress_bits & self.bits[task] and not self.requires[task] & ~progress_bits]
+
+    def progress(self, progress_bits):
+        return {task: bool(progress_bits & bit) for task, bit in self.bits.items()}
+
+    def cohort(self, histogram):
+        """
+        Completion counts and funnel for a group of users, from {progress_bits: user_count}.
+        `reached` counts users who finished every prerequisite of the task (as check_transition and
+        next_tasks see it); `stuck` those of them who have not finished the task itself.
+        """
+        users = sum(histogram.values())
+        steps = []
+        for task in self.tasks:
+            bit = self.bits[task]
+            requires = self.requires[task]
+            reached = sum(count for bits, count in histogram.items() if bits & requires == requires)
+            completed = sum(count for bits, count in histogram.items() if bits & bit)
+            stuck = sum(count for bits, count in histogram.items() if bits & requires == requires and not bits & bit)
+            steps.append({
+                'task': task,
+                'completed': completed,
+                'reached': reached,
+                'stuck': stuck,
+                'drop_off_rate': round(stuck / reached, 4) if reached else 0.0
+            })
+        everything = self.mask(self.tasks)
+        finished = sum(count for bits, count in histogram.items() if bits & everything == everything)
+        return {'users': users, 'finished': finished, 'tasks': steps}
+
+TASK_GRAPH = {
+    role: TaskSequence(role, tasks, TASK_PREREQUISITES.get(role))
+    for role, tasks in TASK_SEQUENCES.items()
+}
+assert all(len(tasks) <= 63 for tasks in TASK_SEQUENCES.values()), 'task_progress_bits is a signed BIGINT'
+
+def task_mask(role, task_names):
+    """Bitmask of task_names in role's sequence. Raises KeyError for a task the role does not have."""
+    return TASK_GRAPH[role].mask(task_names)
+
+def progress_from_bits(role, progress_bits):
+    """{task_name: bool} view of a role's progress bitmask, in sequence order."""
+    return TASK_GRAPH[role].progress(progress_bits) if role in TASK_GRAPH else {}
+
+def bits_from_progress(role, progress):
+    """Inverse of progress_from_bits; tasks no longer in the sequence are dropped."""
+    sequence = TASK_GRAPH.get(role)
+    return sequence.mask([task for task, done in progress.items() if done and task in sequence.bits]) if sequence else 0
+
+def check_transition(user, *task_names, message=None):
+    """
+    Guard for routes that complete tasks. Returns None when `user` may complete task_names now, otherwise an
+    error response naming what is missing. Tasks in the same call count as done for one another, so a chain
+    can be completed at once. Uses only the already loaded user; no queries.
+    """
+    role = user.role.role_name if user.role else None
+    sequence = TASK_GRAPH.get(role)
+    unknown = [task_name for task_name in task_names if sequence is None or task_name not in sequence.bits]
+    if unknown:
+        return jsonify({'error': f"Task '{unknown[0]}' not found for role '{role}'"}), 400
+
+    progress_bits = (user.task_progress_bits or 0) | sequence.mask(task_names)
+    for task_name in task_names:
+        missing = sequence.missing(task_name, progress_bits)
+        if missing:
+            return jsonify({
+                'error': message or f"You must complete {', '.join(missing)} before {task_name}",
+                'missing_tasks': missing
+            }), 400
+    return None
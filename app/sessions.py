@@ -0,0 +1,275 @@
+import copy
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+from app.cache import TTLCache
+
+'''
+Pluggable session storage, chosen with SESSION_BACKEND:
+  'cookie'      the session is a signed cookie; nothing is stored on the server (default)
+  'redis'       the cookie holds a signed session id and the data lives in Redis, or any server speaking
+                the Redis protocol; SESSION_REDIS_URL='memory://' uses an in-process stand-in
+  'sqlalchemy'  the previous Flask-Session table in Postgres, kept while sessions move over
+Cookie and Redis sessions are cached per worker for SESSION_CACHE_TTL seconds, and are only written back
+when their content changed. A background thread in each worker prunes expired sessions in batches.
+'''
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKENDS = ('cookie', 'redis', 'sqlalchemy')
+
+class CookieSession(SecureCookieSession):
+    loaded = None  # Content the request's cookie carried, to tell a real change from a rewrite of the same values
+
+class CachedCookieSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed-cookie sessions, with decoded cookies cached and unchanged sessions not re-sent."""
+
+    session_class = CookieSession
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def open_session(self, app, request):
+        serializer = self.get_signing_serializer(app)
+        if serializer is None:
+            return None
+        value = request.cookies.get(self.get_cookie_name(app))
+        if not value:
+            return self.session_class()
+
+        def load():
+            try:
+                return serializer.loads(value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+            except BadSignature:
+                return None
+        data = self.cache.get_or_load(value, load)
+        if data is None:
+            return self.session_class()
+        session = self.session_class(copy.deepcopy(data))  # The cached dict is shared between requests
+        session.loaded = data
+        return session
+
+    def save_session(self, app, session, response):
+        if session.modified and dict(session) == (session.loaded or {}):
+            session.modified = False  # Same content as the cookie the client already has
+        super().save_session(app, session, response)
+
+    def prune(self, batch_size):
+        return self.cache.prune(batch_size)
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session whose data is stored server-side under `sid`."""
+
+    def __init__(self, initial=None, sid=None, payload=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.payload = payload  # Serialized content as loaded; None for a session not stored yet
+        self.modified = False
+
+class LocalRedis:
+    """
+    In-process stand-in for the few Redis commands sessions use (GET, SET with EX, DEL), for development
+    and tests. Expired keys are dropped when read and by prune().
+    """
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._data[name]
+                return None
+            return entry[0]
+
+    def set(self, name, value, ex=None):
+        value = value.encode('utf-8') if isinstance(value, str) else value
+        with self._lock:
+            self._data[name] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def prune(self, max_entries):
+        now = time.time()
+        with self._lock:
+            expired = [name for name, (_, expires_at) in self._data.items()
+                       if expires_at is not None and expires_at <= now][:max_entries]
+            for name in expired:
+                del self._data[name]
+        return len(expired)
+
+def connect_redis(url):
+    if url.startswith('memory://'):
+        return LocalRedis()
+    import redis  # Optional dependency, only needed when SESSION_BACKEND is 'redis'
+    return redis.Redis.from_url(url)
+
+class RedisSessionInterface(SessionInterface):
+    """Server-side sessions in Redis, keyed by a random id carried in a signed cookie."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, client, key_prefix, cache):
+        self.client = client
+        self.key_prefix = key_prefix
+        self.cache = cache
+
+    def _signer(self, app):
+        # Forged or mistyped ids are turned away without a round trip to Redis
+        return Signer(app.secret_key, salt='session-id')
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+            if sid:
+                payload = self.cache.get_or_load(sid, lambda: self.client.get(self.key_prefix + sid))
+                if payload is not None:
+                    payload = payload.decode('utf-8') if isinstance(payload, bytes) else payload
+                    return ServerSession(self.serializer.loads(payload), sid, payload)
+        return ServerSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        response.vary.add('Cookie')
+
+        if not session:
+            if session.payload is not None:  # Emptied, e.g. on logout
+                self.client.delete(self.key_prefix + session.sid)
+                self.cache.invalidate(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly)
+            return
+
+        payload = self.serializer.dumps(dict(session))
+        if payload == session.payload:
+            return  # Unchanged: no write, and the client already has the cookie
+        ttl = int(app.permanent_session_lifetime.total_seconds())  # Redis expires the key itself
+        self.client.set(self.key_prefix + session.sid, payload, ex=ttl)
+        self.cache.invalidate(session.sid)
+        if session.payload is None:
+            response.set_cookie(
+                name, self._signer(app).sign(session.sid).decode('ascii'),
+                expires=self.get_expiration_time(app, session), httponly=httponly,
+                domain=domain, path=path, secure=secure, samesite=samesite
+            )
+
+    def prune(self, batch_size):
+        pruned = self.cache.prune(batch_size)
+        if isinstance(self.client, LocalRedis):
+            pruned += self.client.prune(batch_size)
+        return pruned
+
+def _prune_sqlalchemy(interface, batch_size):
+    # Flask-Session only removes an expired row when its owner comes back; delete the rest a batch at a time
+    from app import db
+
+    model = interface.sql_session_model
+    expired = db.select(model.id).where(model.expiry <= datetime.utcnow()).limit(batch_size).scalar_subquery()
+    deleted = db.session.execute(db.delete(model).where(model.id.in_(expired))).rowcount
+    db.session.commit()
+    return deleted
+
+def prune_sessions(app, batch_size):
+    """Remove one batch of expired sessions for the configured backend; returns how many went."""
+    interface = app.session_interface
+    if app.config['SESSION_BACKEND'] == 'sqlalchemy':
+        return _prune_sqlalchemy(interface, batch_size)
+    return interface.prune(batch_size)
+
+class _Pruner:
+    """Background thread pruning expired sessions, one per worker process."""
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self, app):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():  # Threads do not survive a fork; each worker starts its own
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(app,), name='session-pruner', daemon=True).start()
+
+    def _run(self, app):
+        interval = app.config['SESSION_PRUNE_INTERVAL']
+        batch_size = app.config['SESSION_PRUNE_BATCH_SIZE']
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    while prune_sessions(app, batch_size) >= batch_size:
+                        time.sleep(0)  # Yield between full batches
+            except Exception:
+                logger.exception('Pruning expired sessions failed')
+
+_pruner = _Pruner()
+
+sessions_cli = AppGroup('sessions', help='Session store maintenance.')
+
+@sessions_cli.command('prune')
+@click.option('--batch-size', default=1000, show_default=True, help='Sessions removed per batch.')
+def prune(batch_size):
+    """Remove every expired session now."""
+    from flask import current_app
+
+    app = current_app._get_current_object()
+    total = 0
+    while True:
+        pruned = prune_sessions(app, batch_size)
+        total += pruned
+        if pruned < batch_size:
+            break
+    click.echo(f'Pruned {total} expired sessions')
+
+def init_app(app, redis_client=None):
+    """Install the SESSION_BACKEND session interface. redis_client overrides SESSION_REDIS_URL, e.g. in tests."""
+    config = app.config
+    backend = config['SESSION_BACKEND']
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"SESSION_BACKEND must be one of {', '.join(SESSION_BACKENDS)}, not {backend!r}")
+
+    cache = TTLCache(config['SESSION_CACHE_SIZE'], config['SESSION_CACHE_TTL'])
+    if backend == 'cookie':
+        app.session_interface = CachedCookieSessionInterface(cache)
+    elif backend == 'redis':
+        client = redis_client if redis_client is not None else connect_redis(config['SESSION_REDIS_URL'])
+        app.session_interface = RedisSessionInterface(client, config['SESSION_KEY_PREFIX'], cache)
+    else:
+        from flask_session import Session
+        from app import db
+        config['SESSION_TYPE'] = 'sqlalchemy'
+        config['SESSION_SQLALCHEMY'] = db  # Provide the existing db instance to Flask-Session
+        Session(app)
+
+    if config['SESSION_PRUNE_INTERVAL']:
+        app.before_request(lambda: _pruner.ensure_running(app))
+    app.cli.add_command(sessions_cli)
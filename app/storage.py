@@ -0,0 +1,316 @@
+import fnmatch
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+import shutil
+import tempfile
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+'''
+Pluggable storage for document bytes.
+Documents keep only metadata in Postgres (SHA-256, size, MIME type); the bytes live in a content-addressed
+blob store, so the same photo uploaded for several listings is stored once. The 'database' backend keeps
+the old behaviour of storing bytes inline in documents.file_data.
+Compressible documents (PDFs, scans, text) are stored gzip- or zstd-compressed; documents.codec records how,
+and readers decompress transparently. Rows with no codec are stored as-is.
+'''
+
+STORAGE_BACKENDS = ('local', 'database')
+SERVE_MODES = ('sendfile', 'x-accel', 'x-sendfile')  # How /documents/<id>/content hands over blob bytes
+CHUNK_SIZE = 64 * 1024
+
+class GzipCodec:
+    name = 'gzip'
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=6, mtime=0)
+
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+    def writer(self, f):
+        # Does not close f when closed
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6, mtime=0)
+
+    def open(self, path):
+        return gzip.open(path, 'rb')
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self):
+        import zstandard  # Optional dependency, only needed when DOCUMENT_COMPRESSION_CODEC is 'zstd'
+        self._zstd = zstandard
+
+    def compress(self, data):
+        return self._zstd.ZstdCompressor(level=10).compress(data)
+
+    def decompress(self, data):
+        return self._zstd.ZstdDecompressor().decompressobj().decompress(data)
+
+    def writer(self, f):
+        return self._zstd.ZstdCompressor(level=10).stream_writer(f, closefd=False)
+
+    def open(self, path):
+        return self._zstd.ZstdDecompressor().stream_reader(open(path, 'rb'))
+
+_codecs = {}
+
+def get_codec(name):
+    """Return the codec stored in documents.codec under name (created on first use)."""
+    if name not in _codecs:
+        if name == 'gzip':
+            _codecs[name] = GzipCodec()
+        elif name == 'zstd':
+            _codecs[name] = ZstdCodec()
+        else:
+            raise ValueError(f'Unknown document codec: {name}')
+    return _codecs[name]
+
+def choose_codec(mime_type, size):
+    """Return the codec name to store a document of mime_type and size with, or None to store it as-is."""
+    config = current_app.config
+    codec = config['DOCUMENT_COMPRESSION_CODEC']
+    if codec == 'none' or size < config['DOCUMENT_COMPRESSION_MIN_SIZE']:
+        return None
+    # Formats that are compressed already (JPEG, PNG, video, archives) would only cost CPU
+    if any(fnmatch.fnmatch(mime_type or '', pattern) for pattern in config['DOCUMENT_COMPRESSION_SKIP_TYPES']):
+        return None
+    return codec
+
+class LocalBlobStore:
+    """Content-addressed blobs on the local filesystem, sharded as <root>/ab/cd/abcd...."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, content_hash, codec=None):
+        path = os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+        return f'{path}.{codec}' if codec else path
+
+    def exists(self, content_hash, codec=None):
+        return os.path.exists(self.path_for(content_hash, codec))
+
+    def put(self, content_hash, data, codec=None, size=None):
+        """
+        Store data (bytes or a binary file) under its hash, compressed with codec when that makes it smaller.
+        A blob that already exists is not written again. Returns (codec used, bytes on disk).
+        """
+        for existing in (codec, None) if codec else (None,):
+            if self.exists(content_hash, existing):
+                return existing, os.path.getsize(self.path_for(content_hash, existing))
+
+        directory = os.path.dirname(self.path_for(content_hash))
+        os.makedirs(directory, exist_ok=True)
+        start = None if isinstance(data, (bytes, bytearray)) else data.tell()
+        temp_path = self._write_temp(directory, data, codec)
+        try:
+            stored_size = os.path.getsize(temp_path)
+            if codec and size is not None and stored_size >= size:
+                # Did not compress; keep the plain bytes instead
+                os.unlink(temp_path)
+                if start is not None:
+                    data.seek(start)
+                codec = None
+                temp_path = self._write_temp(directory, data, None)
+                stored_size = os.path.getsize(temp_path)
+            os.replace(temp_path, self.path_for(content_hash, codec))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return codec, stored_size
+
+    def _write_temp(self, directory, data, codec):
+        # Write to a temporary file that put() renames, so readers never see a partially written blob
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                target = get_codec(codec).writer(f) if codec else f
+                if isinstance(data, (bytes, bytearray)):
+                    target.write(data)
+                else:
+                    shutil.copyfileobj(data, target, CHUNK_SIZE)
+                if codec:
+                    target.close()  # Writes the compressed trailer; leaves f open
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path
+
+    def open(self, content_hash, codec=None):
+        """Open a blob for reading its original (decompressed) bytes."""
+        path = self.path_for(content_hash, codec)
+        return get_codec(codec).open(path) if codec else open(path, 'rb')
+
+    def read(self, content_hash, codec=None):
+        with self.open(content_hash, codec) as f:
+            return f.read()
+
+def get_blob_store():
+    """Return the blob store new document bytes are written to, or None for the inline 'database' backend."""
+    return current_app.extensions.get('blob_store')
+
+def guess_mime_type(file_name):
+    return mimetypes.guess_type(file_name or '')[0] or 'application/octet-stream'
+
+def digest(data):
+    """Return (SHA-256 hex digest, size) of bytes or a binary file, leaving a file at its current position."""
+    if isinstance(data, (bytes, bytearray)):
+        return hashlib.sha256(data).hexdigest(), len(data)
+    if getattr(data, 'content_hash', None):  # Hashed while it was uploaded (app.uploads.HashingSpooledFile)
+        return data.content_hash, data.size
+    start = data.tell()
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: data.read(CHUNK_SIZE), b''):
+        sha256.update(chunk)
+        size += len(chunk)
+    data.seek(start)
+    return sha256.hexdigest(), size
+
+def store_file(data, mime_type=None, file_name=None):
+    """
+    Store `data` with the configured backend and return the Document column values describing it
+    (content_hash, file_size, mime_type, codec, stored_size, file_data).
+    `data` is bytes or a binary file positioned at the start of the content; files are copied in chunks.
+    """
+    content_hash, file_size = digest(data)
+    mime_type = mime_type or guess_mime_type(file_name)
+    codec = choose_codec(mime_type, file_size)
+
+    store = get_blob_store()
+    if store is None:
+        data = data if isinstance(data, (bytes, bytearray)) else data.read()
+        if codec:
+            compressed = get_codec(codec).compress(data)
+            if len(compressed) < len(data):
+                data = compressed
+            else:
+                codec = None
+        file_data, stored_size = data, len(data)
+    else:
+        codec, stored_size = store.put(content_hash, data, codec, file_size)
+        file_data = None
+
+    return {'content_hash': content_hash, 'file_size': file_size, 'mime_type': mime_type,
+            'codec': codec, 'stored_size': stored_size, 'file_data': file_data}
+
+def attach_file(document, data, mime_type=None):
+    """Store `data` as the content of `document` with the configured backend and record its metadata."""
+    for column, value in store_file(data, mime_type, document.file_name).items():
+        setattr(document, column, value)
+
+def decode(data, codec):
+    """Return the original bytes of inline file_data stored with codec."""
+    return get_codec(codec).decompress(data) if codec else data
+
+def read_file(document):
+    """Return the original bytes of `document`, wherever and however they are stored."""
+    if document.stored_inline:
+        return decode(document.file_data, document.codec)
+    return blob_store_for_reads().read(document.content_hash, document.codec)
+
+def file_source(document):
+    """
+    Return something send_file can stream the original bytes of `document` from: a blob path, a BytesIO
+    for inline bytes, or a decompressing reader for compressed blobs.
+    """
+    if document.stored_inline:
+        return io.BytesIO(read_file(document))
+    store = blob_store_for_reads()
+    if document.codec:
+        return store.open(document.content_hash, document.codec)
+    return store.path_for(document.content_hash)
+
+def blob_store_for_reads():
+    """Return the blob store existing blobs are read from, whatever backend new documents use."""
+    # Rows moved out of the database stay readable even if the backend is later switched back
+    return get_blob_store() or LocalBlobStore(current_app.config['DOCUMENT_STORAGE_ROOT'])
+
+documents_cli = AppGroup('documents', help='Document storage maintenance.')
+
+@documents_cli.command('migrate-blobs')
+@click.option('--batch-size', default=100, show_default=True, help='Documents moved per transaction.')
+def migrate_blobs(batch_size):
+    """Move document bytes still stored inline in Postgres into the blob store."""
+    from sqlalchemy.orm import undefer
+    from app import db
+    from app.models import Document
+
+    store = get_blob_store()
+    if store is None:
+        raise click.ClickException("DOCUMENT_STORAGE_BACKEND is 'database'; there is no blob store to move bytes to")
+
+    moved = 0
+    last_id = 0
+    while True:
+        # Walk the table by primary key so each batch is an index range scan and memory stays bounded
+        documents = Document.query.options(undefer(Document.file_data)) \
+            .filter(Document.id > last_id, Document.file_data.isnot(None)) \
+            .order_by(Document.id).limit(batch_size).all()
+        if not documents:
+            break
+        for document in documents:
+            attach_file(document, read_file(document), document.mime_type)
+        last_id = documents[-1].id
+        db.session.commit()
+        db.session.expunge_all()
+        moved += len(documents)
+        click.echo(f'Moved {moved} documents (last id {last_id})')
+
+    click.echo(f'Done: {moved} documents moved to {store.root}')
+
+@documents_cli.command('storage-report')
+def storage_report():
+    """Show how many bytes compression and deduplication save, per codec."""
+    from sqlalchemy import func
+    from app import db
+    from app.models import Document
+
+    codec = func.coalesce(Document.codec, 'none')
+    stored_size = func.coalesce(Document.stored_size, Document.file_size)
+    rows = db.session.execute(
+        db.select(codec, func.count(), func.sum(Document.file_size), func.sum(stored_size))
+        .group_by(codec).order_by(codec)
+    ).all()
+
+    # Blobs shared by several documents take space once
+    blobs = db.select(Document.content_hash, Document.codec, func.max(stored_size).label('size')) \
+        .where(Document.file_data.is_(None)).group_by(Document.content_hash, Document.codec).subquery()
+    inline = db.select(func.coalesce(func.sum(stored_size), 0)).where(Document.file_data.isnot(None)).scalar_subquery()
+    on_disk = db.session.scalar(db.select(func.coalesce(func.sum(blobs.c.size), 0) + inline))
+
+    def saved(original, stored):
+        return f'{100 * (1 - stored / original):.1f}%' if original else '-'
+
+    click.echo(f"{'codec':<8}{'documents':>12}{'original':>16}{'stored':>16}{'saved':>8}")
+    total_original = total_stored = 0
+    for name, count, original, stored in rows:
+        original, stored = original or 0, stored or 0
+        total_original += original
+        total_stored += stored
+        click.echo(f'{name:<8}{count:>12}{original:>16}{stored:>16}{saved(original, stored):>8}')
+    click.echo(f"{'total':<8}{sum(row[1] for row in rows):>12}{total_original:>16}{total_stored:>16}"
+               f'{saved(total_original, total_stored):>8}')
+    click.echo(f'After deduplication: {on_disk} bytes stored ({saved(total_original, on_disk)} saved overall)')
+
+def init_app(app):
+    backend = app.config['DOCUMENT_STORAGE_BACKEND']
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"DOCUMENT_STORAGE_BACKEND must be one of: {', '.join(STORAGE_BACKENDS)}")
+    serve_mode = app.config['DOCUMENT_SERVE_MODE']
+    if serve_mode not in SERVE_MODES:
+        raise ValueError(f"DOCUMENT_SERVE_MODE must be one of: {', '.join(SERVE_MODES)}")
+    app.config['USE_X_SENDFILE'] = serve_mode == 'x-sendfile'  # send_file then only sets the header for blob paths
+    if app.config['DOCUMENT_COMPRESSION_CODEC'] != 'none':
+        get_codec(app.config['DOCUMENT_COMPRESSION_CODEC'])  # Fail at startup on a typo or a missing zstandard package
+    if backend == 'local':
+        app.extensions['blob_store'] = LocalBlobStore(app.config['DOCUMENT_STORAGE_ROOT'])
+    app.cli.add_command(documents_cli)
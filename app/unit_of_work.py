@@ -0,0 +1,61 @@
+from flask import g, request, jsonify, make_response, has_request_context, current_app
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from app import db
+
+'''
+Request-scoped unit of work.
+Every request runs in one transaction: views add, change and flush, but do not commit. Once the view has
+returned, finish() commits if the response is a success and rolls back otherwise, so a request either
+saves everything or nothing, with a single COMMIT (one WAL flush) however many rows it touched.
+Views that need database-assigned ids call db.session.flush(); views that must handle write conflicts
+(StaleDataError, constraint violations) flush inside their own try block.
+Commits and flushes are counted per request and reported in the X-DB-Commits and X-DB-Flushes headers.
+'''
+
+@event.listens_for(Session, 'after_commit')
+def _count_commit(session):
+    if has_request_context():
+        g.db_commits = g.get('db_commits', 0) + 1
+
+@event.listens_for(Session, 'after_flush')
+def _count_flush(session, flush_context):
+    if has_request_context():
+        g.db_flushes = g.get('db_flushes', 0) + 1
+
+def finish(response):
+    """
+    Commit the request's transaction if `response` is a success (status below 400), roll it back otherwise.
+    Runs once per request; later calls return the response untouched. Returns the response to send, which
+    is an error response instead when the commit fails.
+    """
+    if g.get('unit_of_work_finished'):
+        return response
+    g.unit_of_work_finished = True
+
+    if not db.session().in_transaction():
+        return response  # Nothing was read or written, e.g. a streaming response that gave its session back
+    if response.status_code >= 400:
+        db.session.rollback()
+        return response
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return make_response(jsonify({'error': 'The record was modified by someone else; reload and retry'}), 409)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.exception('Committing %s failed', request.endpoint)
+        return make_response(jsonify({'error': str(e)}), 500)
+    return response
+
+def _finish_request(response):
+    response = finish(response)
+    response.headers['X-DB-Commits'] = str(g.get('db_commits', 0))
+    response.headers['X-DB-Flushes'] = str(g.get('db_flushes', 0))
+    return response
+
+def init_app(app):
+    app.after_request(_finish_request)
@@ -0,0 +1,70 @@
+import hashlib
+import tempfile
+from flask import Request, current_app, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+
+'''
+Streaming multipart uploads.
+Werkzeug hands every file part of a multipart body to Request._get_file_stream chunk by chunk; we give it
+a spooled temporary file that hashes and counts the bytes as they arrive and rejects the upload as soon as
+it passes the size limit for its endpoint or type. Views then pass the file handle (not bytes) on to storage.
+'''
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """Spooled temporary file that keeps a running SHA-256 and size, and enforces a size limit on write."""
+
+    def __init__(self, spool_size, limit=None, file_name=None, content_type=None):
+        super().__init__(max_size=spool_size, mode='w+b')
+        self.limit = limit
+        self.file_name = file_name
+        self.content_type = content_type
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            raise too_large(self.file_name, self.content_type, self.limit)
+        self._sha256.update(data)
+        return super().write(data)
+
+    @property
+    def content_hash(self):
+        return self._sha256.hexdigest()
+
+def upload_limit(content_type, endpoint=None):
+    """
+    Return the size limit in bytes for an upload of content_type to endpoint, or None for no limit.
+    A limit set for the endpoint wins: clients often declare files as application/octet-stream.
+    """
+    endpoint_limits = current_app.config['UPLOAD_ENDPOINT_SIZE_LIMITS']
+    if endpoint in endpoint_limits:
+        return endpoint_limits[endpoint]
+    limits = current_app.config['UPLOAD_SIZE_LIMITS']
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    for key in (content_type, content_type.split('/')[0] + '/*'):
+        if key in limits:
+            return limits[key]
+    return current_app.config['UPLOAD_DEFAULT_SIZE_LIMIT']
+
+def too_large(file_name, content_type, limit):
+    return RequestEntityTooLarge(
+        f"{file_name or 'Upload'} is larger than the {limit / (1024 * 1024):g} MB limit for {content_type or 'this file type'}"
+    )
+
+class UploadRequest(Request):
+    """Request class that streams file parts into HashingSpooledFile instead of memory."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = upload_limit(content_type, self.endpoint)
+        # Reject up front when the part declares its length; otherwise the limit is checked as chunks arrive
+        if limit is not None and content_length and content_length > limit:
+            raise too_large(filename, content_type, limit)
+        return HashingSpooledFile(current_app.config['UPLOAD_SPOOL_SIZE'], limit, filename, content_type)
+
+def _entity_too_large(e):
+    return jsonify({'error': e.description}), 413
+
+def init_app(app):
+    app.request_class = UploadRequest
+    app.register_error_handler(RequestEntityTooLarge, _entity_too_large)
@@ -1,5 +1,11 @@
-from flask import session, redirect, url_for, jsonify
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from flask import session, redirect, url_for, jsonify, request, current_app, abort, make_response, g, has_request_context
 from functools import wraps
+from sqlalchemy import tuple_, event
+from sqlalchemy.engine import Engine
 
 def login_required(f):
     """Decorator to protect routes and ensure the user is logged in."""
@@ -14,3 +20,104 @@ def logout_user():
     """Clear the session to log out the user."""
     session.pop('user_id', None)
     session.pop('user_name', None)
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page as an opaque, URL-safe cursor token."""
+    payload = [v.isoformat() if isinstance(v, datetime) else str(v) if isinstance(v, Decimal) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, columns):
+    """Decode a cursor token back into typed sort-key values for the given columns."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            raise ValueError('cursor does not match sort key')
+        values = []
+        for column, value in zip(columns, payload):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                values.append(datetime.fromisoformat(value))
+            else:
+                values.append(python_type(value))
+        return values
+    except (ValueError, TypeError):
+        abort(make_response(jsonify({'error': 'Invalid cursor'}), 400))
+
+def page_limit(default=None):
+    """Read ?limit= from the query string, clamped to the server-side PAGINATION_MAX_LIMIT."""
+    default_limit = default or current_app.config['PAGINATION_DEFAULT_LIMIT']
+    limit = request.args.get('limit', default_limit, type=int)
+    return max(1, min(limit, current_app.config['PAGINATION_MAX_LIMIT']))
+
+def keyset_paginate(query, order_by, descending=False):
+    """
+    Return one page of `query` using keyset (seek) pagination instead of OFFSET.
+    `order_by` must uniquely order the rows, e.g. (Listing.created_at, Listing.id), and be backed by an index
+    so every page is an index range scan. Reads `limit` and `cursor` from the query string and returns
+    (items, next_cursor); next_cursor is None on the last page.
+    """
+    limit = page_limit()
+    cursor = request.args.get('cursor')
+    if cursor:
+        key = tuple_(*order_by)
+        last_seen = tuple(decode_cursor(cursor, order_by))
+        query = query.filter(key < last_seen if descending else key > last_seen)
+
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in order_by])
+
+    # Fetch one extra row to know whether another page exists
+    items = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in order_by])
+    return items, next_cursor
+
+def with_next_cursor(response, next_cursor):
+    """Attach the next page cursor to a list response as the X-Next-Cursor header."""
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def register_query_counter():
+    """Count SQL statements issued while handling the current request (read by query_budget)."""
+    if event.contains(Engine, 'before_cursor_execute', _count_query):
+        return
+    event.listen(Engine, 'before_cursor_execute', _count_query)
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+def query_budget(max_queries):
+    """
+    Decorator declaring how many SQL statements a view may issue.
+    Going over budget logs a warning, and raises when QUERY_BUDGET_ENFORCE is set or the app is under test,
+    so an N+1 regression fails the test suite instead of reaching production.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.query_count = 0
+            response = f(*args, **kwargs)
+            if g.query_count > max_queries:
+                message = f'{request.endpoint} issued {g.query_count} queries, budget is {max_queries}'
+                if current_app.config['QUERY_BUDGET_ENFORCE'] or current_app.testing:
+                    raise AssertionError(message)
+                current_app.logger.warning(message)
+            return response
+        return decorated_function
+    return decorator
+
+def not_modified(etag):
+    """
+    Return a 304 response if the client's If-None-Match already has `etag`, otherwise None.
+    Lets polling endpoints answer from a version number without loading or serializing the row.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    return None
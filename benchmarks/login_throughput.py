@@ -0,0 +1,98 @@
+"""
+Login throughput benchmark.
+
+Measures password checks per second, in total and per core, through the same hashing pool /auth/login
+uses (app/passwords.py), or end to end against a running server:
+
+    python benchmarks/login_throughput.py --rounds 12 --concurrency 16 --duration 10
+    python benchmarks/login_throughput.py --inline            # bcrypt on the calling threads, for comparison
+    python benchmarks/login_throughput.py --url http://localhost:5001 --email a@b.com --password secret
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run_threads(concurrency, duration, login):
+    """Call login() from `concurrency` threads for `duration` seconds; returns (completed, rejected)."""
+    counts = {'ok': 0, 'rejected': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def loop():
+        ok = rejected = 0
+        while time.monotonic() < deadline:
+            if login():
+                ok += 1
+            else:
+                rejected += 1
+        with lock:
+            counts['ok'] += ok
+            counts['rejected'] += rejected
+
+    threads = [threading.Thread(target=loop) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts['ok'], counts['rejected']
+
+def pool_login(args):
+    from app.passwords import PasswordHasher, PasswordHasherBusy, _check, _hash
+
+    password = 'benchmark-password'
+    password_hash = _hash(password, args.rounds)
+    if args.inline:
+        return lambda: _check(password, password_hash), 'inline'
+
+    hasher = PasswordHasher(args.rounds, args.workers, args.max_pending, wait_timeout=args.wait_timeout)
+    hasher.check(password, password_hash)  # Start the pool before timing
+
+    def login():
+        try:
+            return hasher.check(password, password_hash)
+        except PasswordHasherBusy:
+            return False
+    return login, f'pool of {hasher.workers}, {hasher.max_pending} pending max'
+
+def http_login(args):
+    import requests
+
+    session = threading.local()
+
+    def login():
+        if not hasattr(session, 'http'):
+            session.http = requests.Session()
+        response = session.http.post(f'{args.url}/auth/login', json={'email': args.email, 'password': args.password})
+        return response.status_code == 200
+    return login, args.url
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost (BCRYPT_LOG_ROUNDS)')
+    parser.add_argument('--workers', type=int, default=None, help='Hashing processes (default: one per core)')
+    parser.add_argument('--max-pending', type=int, default=None, help='Hashes in flight before rejecting')
+    parser.add_argument('--wait-timeout', type=float, default=1.0, help='Seconds to wait for a free slot')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent logins')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+    parser.add_argument('--inline', action='store_true', help='Hash on the calling threads instead of the pool')
+    parser.add_argument('--url', help='Benchmark POST /auth/login on a running server instead')
+    parser.add_argument('--email', help='Login for --url')
+    parser.add_argument('--password', help='Password for --url')
+    args = parser.parse_args()
+
+    if args.url and not (args.email and args.password):
+        parser.error('--url needs --email and --password')
+    login, description = http_login(args) if args.url else pool_login(args)
+
+    completed, rejected = run_threads(args.concurrency, args.duration, login)
+    cores = os.cpu_count() or 1
+    per_second = completed / args.duration
+    print(f'{description}: {completed} logins in {args.duration:g}s with {args.concurrency} concurrent clients')
+    print(f'{per_second:.1f} logins/s, {per_second / cores:.1f} per core ({cores} cores), {rejected} rejected')
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import os, db
+import os
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,5 +9,63 @@ class Config:
         'postgresql://postgres:postgres@db:5432/homekey'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DEBUG = True  # Enable debug mode
-    SESSION_TYPE = 'sqlalchemy'
-    SESSION_SQLALCHEMY = db  # This refers to the SQLAlchemy instance
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or 'cookie'  # 'cookie', 'redis' (needs redis) or 'sqlalchemy' (needs Flask-Session, only imported then); see app/sessions.py
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL') or 'redis://redis:6379/0'  # 'memory://' for an in-process stand-in
+    SESSION_KEY_PREFIX = 'session:'  # Prefix of Redis session keys
+    SESSION_CACHE_SIZE = 10000  # Sessions cached per worker
+    SESSION_CACHE_TTL = 5  # Seconds; a session changed in another worker can look unchanged here for this long
+    SESSION_PRUNE_INTERVAL = 300  # Seconds between background passes over expired sessions (0 disables them)
+    SESSION_PRUNE_BATCH_SIZE = 1000  # Expired sessions removed per batch
+    PAGINATION_DEFAULT_LIMIT = 50  # Page size when the client does not send ?limit=
+    PAGINATION_MAX_LIMIT = 200  # Hard cap on ?limit= for list endpoints
+    QUERY_BUDGET_ENFORCE = os.environ.get('QUERY_BUDGET_ENFORCE') == '1'  # Raise instead of warn when a view exceeds its query budget
+    LISTING_STREAM_BATCH_SIZE = 100  # Rows fetched per server-side cursor round trip when streaming listings
+    LISTING_CACHE_SIZE = 1024  # Serialized listings kept per worker for get_listing_by_id
+    LISTING_FEED_CACHE_SIZE = 64  # Buyer feed pages kept per worker
+    LISTING_CACHE_TTL = 30  # Seconds; an upper bound on staleness if a notification is ever lost
+    PUBSUB_ENABLED = True  # Listen for cross-worker notifications (Postgres only)
+    BULK_IMPORT_MAX_REPORTED_ERRORS = 1000  # Per-row errors returned by a bulk import; the total is always reported
+    BULK_IMPORT_SPOOL_SIZE = 16 * 1024 * 1024  # Bytes of validated rows kept in memory before spilling to disk
+    DOCUMENT_STORAGE_BACKEND = os.environ.get('DOCUMENT_STORAGE_BACKEND') or 'local'  # 'local' blob store or 'database' (inline BYTEA)
+    DOCUMENT_STORAGE_ROOT = os.environ.get('DOCUMENT_STORAGE_ROOT') or \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'blobs')
+    DOCUMENT_CACHE_MAX_AGE = 3600  # Seconds clients may cache document bytes before revalidating with the ETag
+    PHOTO_VARIANTS = {'thumbnail': (200, 200), 'card': (640, 480), 'full': (1600, 1600)}  # Name -> max (width, height)
+    PHOTO_VARIANT_QUALITY = 82  # JPEG quality of rendered variants
+    PHOTO_VARIANT_WORKERS = 2  # Processes per worker rendering variants
+    PHOTO_BATCH_MAX_FILES = 50  # Photos per /listings/upload_photos request
+    MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # Whole request body
+    UPLOAD_SPOOL_SIZE = 1024 * 1024  # Uploads larger than this spill from memory to a temporary file
+    UPLOAD_SIZE_LIMITS = {  # Per-file limits by MIME type ('type/*' matches the whole type)
+        'application/pdf': 50 * 1024 * 1024,
+        'image/*': 25 * 1024 * 1024,
+        'text/csv': 100 * 1024 * 1024,  # Bulk listing imports
+        'application/x-ndjson': 100 * 1024 * 1024,
+    }
+    UPLOAD_DEFAULT_SIZE_LIMIT = 10 * 1024 * 1024
+    UPLOAD_ENDPOINT_SIZE_LIMITS = {  # Per-file limits by endpoint, ahead of the declared MIME type
+        'listings.bulk_import': 100 * 1024 * 1024,
+    }
+    DOCUMENT_COMPRESSION_CODEC = os.environ.get('DOCUMENT_COMPRESSION_CODEC') or 'gzip'  # 'gzip', 'zstd' (needs zstandard) or 'none'
+    DOCUMENT_COMPRESSION_MIN_SIZE = 4 * 1024  # Smaller documents are stored as-is
+    DOCUMENT_COMPRESSION_SKIP_TYPES = (  # Already compressed; patterns as in fnmatch
+        'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/heic', 'image/avif',
+        'video/*', 'audio/*', 'application/zip', 'application/gzip', 'application/zstd',
+        'application/x-7z-compressed', 'application/vnd.openxmlformats-officedocument.*'
+    )
+    DOCUMENT_URL_TTL = 3600  # Seconds; signed document URLs stay valid for one to two of these windows
+    DOCUMENT_URLS_REQUIRE_SIGNATURE = True  # Reject /documents/<id>/content requests without a valid signature
+    DOCUMENT_SERVE_MODE = os.environ.get('DOCUMENT_SERVE_MODE') or 'sendfile'  # 'sendfile', 'x-accel' (nginx) or 'x-sendfile'
+    DOCUMENT_ACCEL_PREFIX = '/_blobs/'  # nginx internal location aliased to DOCUMENT_STORAGE_ROOT
+    EVENTS_QUEUE_SIZE = 100  # Undelivered events buffered per stream before it is closed and must resume
+    EVENTS_HEARTBEAT_INTERVAL = 15  # Seconds between keepalive comments on idle streams
+    EVENTS_RETRY_MS = 3000  # Reconnect delay suggested to EventSource clients
+    EVENTS_REPLAY_LIMIT = 500  # Missed events sent to a resuming client
+    EVENTS_RETENTION_DAYS = 7  # `flask events purge` deletes older events
+    IDEMPOTENCY_KEY_TTL = 24 * 3600  # Seconds a stored response is replayed for its Idempotency-Key
+    IDEMPOTENCY_LOCK_TIMEOUT = 60  # Seconds after which an unfinished claim is treated as abandoned
+    COHORT_STATS_CACHE_TTL = 60  # Seconds get_cohort_stats serves a cached snapshot before recounting
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS') or 12)  # bcrypt cost; older hashes are upgraded at login
+    PASSWORD_HASH_WORKERS = None  # Hashing processes per worker (default: one per core)
+    PASSWORD_HASH_MAX_PENDING = None  # Hashes running or queued per worker before logins get a 503 (default: 4 per process)
+    PASSWORD_HASH_WAIT_TIMEOUT = 1.0  # Seconds a login waits for a free hashing slot before the 503
@@ -3,5 +3,17 @@ set -e
 chmod +x /docker-entrypoint-initdb.d/init.sh
 psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-EOSQL
     \i /docker-entrypoint-initdb.d/migrations/01_create_schema.sql
+    \i /docker-entrypoint-initdb.d/migrations/02_keyset_pagination_indexes.sql
+    \i /docker-entrypoint-initdb.d/migrations/03_listing_search_indexes.sql
+    \i /docker-entrypoint-initdb.d/migrations/04_listing_text_search.sql
+    \i /docker-entrypoint-initdb.d/migrations/05_version_columns.sql
+    \i /docker-entrypoint-initdb.d/migrations/06_document_blob_metadata.sql
+    \i /docker-entrypoint-initdb.d/migrations/07_document_variants.sql
+    \i /docker-entrypoint-initdb.d/migrations/08_document_compression.sql
+    \i /docker-entrypoint-initdb.d/migrations/09_app_events.sql
+    \i /docker-entrypoint-initdb.d/migrations/10_listing_offer_stats.sql
+    \i /docker-entrypoint-initdb.d/migrations/11_idempotency_keys.sql
+    \i /docker-entrypoint-initdb.d/migrations/12_task_progress_bits.sql
+    \i /docker-entrypoint-initdb.d/migrations/13_task_progress_cohort_index.sql
     \i /docker-entrypoint-initdb.d/seeds/01_seed_data.sql
 EOSQL
@@ -0,0 +1,8 @@
+-- Indexes backing keyset pagination on (created_at, id).
+-- Each list endpoint filters on one column and then seeks past the cursor, so the
+-- filter column leads and (created_at, id) follows to give an index range scan.
+CREATE INDEX IF NOT EXISTS idx_listing_created_at_id ON Listings(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_listing_status_created_at_id ON Listings(status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_listing_seller_created_at_id ON Listings(seller_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_offer_listing_created_at_id ON Offers(listing_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_offer_buyer_created_at_id ON Offers(buyer_id, created_at, id);
@@ -0,0 +1,9 @@
+-- Indexes backing /listings/search.
+-- Buyers only search approved listings, so the hot paths get partial indexes restricted to
+-- status = 'Approved'; they stay small and let the planner skip every other status.
+CREATE INDEX IF NOT EXISTS idx_listing_approved_price_id ON Listings(price, id) WHERE status = 'Approved';
+CREATE INDEX IF NOT EXISTS idx_listing_approved_beds_baths_price ON Listings(bedrooms, bathrooms, price) WHERE status = 'Approved';
+CREATE INDEX IF NOT EXISTS idx_listing_approved_sqft ON Listings(squarefootage) WHERE status = 'Approved';
+
+-- FSH agents can search any status; lead with status so each status is a contiguous range.
+CREATE INDEX IF NOT EXISTS idx_listing_status_price_id ON Listings(status, price, id);
@@ -0,0 +1,14 @@
+-- Full-text search over listing title and description, and trigram matching on address.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Generated column: Postgres keeps it in sync on every INSERT/UPDATE, no trigger needed.
+ALTER TABLE Listings ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_listing_search_vector ON Listings USING GIN (search_vector);
+
+-- Trigram index serves ILIKE '%term%' and 'term%' address lookups used by autocomplete.
+CREATE INDEX IF NOT EXISTS idx_listing_address_trgm ON Listings USING GIN (address gin_trgm_ops);
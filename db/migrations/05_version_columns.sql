@@ -0,0 +1,4 @@
+-- Row versions used for ETags and optimistic locking (SQLAlchemy version_id_col).
+ALTER TABLE Listings ADD COLUMN IF NOT EXISTS version_id INT NOT NULL DEFAULT 1;
+ALTER TABLE Listings ADD COLUMN IF NOT EXISTS offers_version INT NOT NULL DEFAULT 1;  -- Bumped when any offer on the listing changes
+ALTER TABLE Users ADD COLUMN IF NOT EXISTS version_id INT NOT NULL DEFAULT 1;
@@ -0,0 +1,13 @@
+-- Document bytes move to a content-addressed blob store; rows keep the hash, size and MIME type.
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS file_size BIGINT;
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS mime_type VARCHAR(255);
+ALTER TABLE Documents ALTER COLUMN file_data DROP NOT NULL;
+
+-- Backfill metadata for rows still stored inline; `flask documents migrate-blobs` then moves their bytes out.
+UPDATE Documents
+SET content_hash = encode(sha256(file_data), 'hex'),
+    file_size = octet_length(file_data)
+WHERE file_data IS NOT NULL AND content_hash IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_document_content_hash ON Documents(content_hash);
@@ -0,0 +1,7 @@
+-- Resized copies of listing photos are Documents linked to the original they were rendered from.
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS parent_id INT REFERENCES Documents(id) ON DELETE CASCADE;
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS variant VARCHAR(20);
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS width INT;
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS height INT;
+
+CREATE INDEX IF NOT EXISTS idx_document_parent ON Documents(parent_id) WHERE parent_id IS NOT NULL;
@@ -0,0 +1,5 @@
+-- Documents may be stored compressed; codec says how (NULL = as-is) and stored_size how many bytes that takes.
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS codec VARCHAR(10);
+ALTER TABLE Documents ADD COLUMN IF NOT EXISTS stored_size BIGINT;
+
+UPDATE Documents SET stored_size = file_size WHERE stored_size IS NULL;
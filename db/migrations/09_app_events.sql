@@ -0,0 +1,10 @@
+-- Per-user change events behind /events/stream; kept for a few days so clients can resume with Last-Event-ID.
+CREATE TABLE IF NOT EXISTS app_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES Users(id) ON DELETE CASCADE,
+    event_type VARCHAR(50) NOT NULL,
+    data JSONB NOT NULL DEFAULT '{}',
+    created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS idx_app_events_user ON app_events(user_id, id);
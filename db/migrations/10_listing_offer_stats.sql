@@ -0,0 +1,27 @@
+-- Per-listing offer summary, maintained by submit_offer and respond_offer in the same transaction as the offer.
+CREATE TABLE IF NOT EXISTS listing_offer_stats (
+    listing_id INT PRIMARY KEY REFERENCES Listings(id) ON DELETE CASCADE,
+    offer_count INT NOT NULL DEFAULT 0,
+    pending_count INT NOT NULL DEFAULT 0,
+    highest_offer NUMERIC(10, 2),
+    lowest_offer NUMERIC(10, 2),
+    latest_offer_id INT REFERENCES Offers(id) ON DELETE SET NULL,
+    latest_offer_price NUMERIC(10, 2),
+    latest_offer_at TIMESTAMP
+);
+
+-- Backfill from the offers already on file
+INSERT INTO listing_offer_stats (listing_id, offer_count, pending_count, highest_offer, lowest_offer,
+                                 latest_offer_id, latest_offer_price, latest_offer_at)
+SELECT o.listing_id, count(*), count(*) FILTER (WHERE o.status = 'Pending'), max(o.offer_price), min(o.offer_price),
+       latest.id, latest.offer_price, latest.created_at
+FROM Offers o
+CROSS JOIN LATERAL (
+    SELECT l.id, l.offer_price, l.created_at FROM Offers l
+    WHERE l.listing_id = o.listing_id
+    ORDER BY l.created_at DESC, l.id DESC
+    LIMIT 1
+) latest
+WHERE o.listing_id IS NOT NULL
+GROUP BY o.listing_id, latest.id, latest.offer_price, latest.created_at
+ON CONFLICT (listing_id) DO NOTHING;
@@ -0,0 +1,14 @@
+-- Idempotency-Key claims and the responses replayed to retries; `flask idempotency purge` removes expired rows.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    endpoint VARCHAR(100) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code INT,
+    response_body BYTEA,
+    response_mimetype VARCHAR(100),
+    created_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (endpoint, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
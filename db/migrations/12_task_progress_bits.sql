@@ -0,0 +1,7 @@
+-- Task progress as a bitmask: bit i is set once task i of the user's role sequence (app/routes/tasks.py) is done.
+-- Completing a task is then a single atomic UPDATE ... SET task_progress_bits = task_progress_bits | mask.
+ALTER TABLE Users ADD COLUMN IF NOT EXISTS task_progress_bits BIGINT NOT NULL DEFAULT 0;
+
+-- The JSONB task_progress column is no longer read or written. Convert existing rows with
+-- `flask task_progress backfill-bits` (the task order lives in Python), then drop it:
+--   ALTER TABLE Users DROP COLUMN task_progress;
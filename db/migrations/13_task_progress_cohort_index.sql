@@ -0,0 +1,2 @@
+-- Backs get_cohort_stats: counting users per (role_id, task_progress_bits) is an index-only scan.
+CREATE INDEX IF NOT EXISTS idx_users_role_task_progress ON Users(role_id, task_progress_bits);
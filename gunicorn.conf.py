@@ -0,0 +1,13 @@
+# gunicorn settings used by the Procfile and the Dockerfile.
+# gevent workers serve each request in a greenlet, so thousands of idle /events/stream connections cost
+# memory, not threads; psycogreen makes psycopg2 yield to other greenlets while it waits on Postgres.
+
+bind = '0.0.0.0:5001'
+workers = 2
+worker_class = 'gevent'
+worker_connections = 2000  # Concurrent connections (mostly idle event streams) per worker
+timeout = 60
+
+def post_fork(server, worker):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import pytest
+
+# Run the app on in-memory SQLite; set before config.py is imported
+os.environ['DATABASE_URL'] = 'sqlite://'  # Never a real database: the fixtures drop every table
+os.environ.setdefault('DOCUMENT_STORAGE_ROOT', tempfile.mkdtemp(prefix='homekey-test-blobs-'))
+
+from sqlalchemy import BigInteger, event
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+
+# Postgres-only column types, rendered as their closest SQLite equivalents
+@compiles(JSONB, 'sqlite')
+def _jsonb(type_, compiler, **kw):
+    return 'JSON'
+
+@compiles(TSVECTOR, 'sqlite')
+def _tsvector(type_, compiler, **kw):
+    return 'TEXT'
+
+@compiles(BigInteger, 'sqlite')
+def _bigint(type_, compiler, **kw):
+    return 'INTEGER'  # SQLite only autoincrements INTEGER PRIMARY KEY
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_functions(dbapi_connection, connection_record):
+    # Stand-ins for the Postgres functions used by listings.search_vector and the offer stats upsert
+    if hasattr(dbapi_connection, 'create_function'):
+        dbapi_connection.create_function('to_tsvector', 2, lambda config, text: text, deterministic=True)
+        dbapi_connection.create_function('setweight', 2, lambda vector, weight: vector, deterministic=True)
+        dbapi_connection.create_function('greatest', 2, max, deterministic=True)
+        dbapi_connection.create_function('least', 2, min, deterministic=True)
+
+@pytest.fixture
+def app():
+    import config
+    from app import create_app, db
+
+    config.Config.TESTING = True
+    config.Config.SQLALCHEMY_ENGINE_OPTIONS = {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,47 @@
+import pytest
+from app import db
+from app.models import Document, Listing, Role, User
+from app.utils import query_budget
+
+def _user(role, name):
+    user = User(name=name, email=f'{name}@example.com', role=role)
+    user.password_hash = 'not-a-real-hash'
+    db.session.add(user)
+    return user
+
+@pytest.fixture
+def listings(app):
+    """An FSH agent and a seller with several listings, each with photos and documents."""
+    with app.app_context():
+        roles = {name: Role(role_name=name) for name in ('Seller', 'Buyer', 'FSH')}
+        db.session.add_all(roles.values())
+        seller = _user(roles['Seller'], 'seller')
+        agent = _user(roles['FSH'], 'agent')
+        db.session.flush()
+        for n in range(5):
+            listing = Listing(seller_id=seller.id, title=f'Home {n}', price=100000 + n, description='Nice', address=f'{n} Main St')
+            db.session.add(listing)
+            db.session.flush()
+            for kind in ('Photo', 'Disclosure', 'Photo'):
+                db.session.add(Document(listing_id=listing.id, uploaded_by=seller.id, document_type=kind,
+                                        file_name=f'{kind.lower()}.bin', file_data=b'data', mime_type='application/octet-stream'))
+        db.session.commit()
+        return agent.id
+
+def test_get_all_listings_stays_within_budget(client, listings):
+    # query_budget raises AssertionError under testing, which the test client propagates
+    response = client.get(f'/listings/get_all_listings?user_id={listings}')
+    assert response.status_code == 200
+    assert len(response.json) == 5
+    assert all(len(listing['documents']) == 3 for listing in response.json)
+
+def test_over_budget_view_raises(app, client, listings):
+    @app.route('/test/over_budget')
+    @query_budget(1)
+    def over_budget():
+        for listing in Listing.query.all():
+            listing.documents  # Lazy load per listing: the N+1 the budget exists to catch
+        return {'ok': True}
+
+    with pytest.raises(AssertionError, match='budget is 1'):
+        client.get('/test/over_budget')